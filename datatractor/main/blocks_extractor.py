@@ -2,21 +2,38 @@ from datatractor.utils.gamepedia_wiki_tools import *
 from datatractor.utils.http_tools import *
 from datatractor.utils.string_tools import *
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 
-def extract_blocks(date_limit: date):
+def extract_blocks(date_limit: date, jobs: int = 1):
+	"""
+	Extracts the blocks that existed at the given date.
+	:param date_limit: the date to search before
+	:param jobs: the number of block pages to fetch and parse concurrently
+	:return: the list of the blocks, in the order of the block IDs page
+	"""
+	blocks = []
+	for table in find_block_tables(date_limit):
+		extract_blocks_from_table(date_limit, table, blocks, jobs)
+	return blocks
+
+
+def find_block_tables(date_limit: date):
+	"""Finds the tables of the block IDs page, as it was at the given date."""
 	url = find_revision_url("Java_Edition_data_values/Block_IDs", date_limit)
 	ids_html = robust_request(url).text
-	soup = BeautifulSoup(ids_html, "lxml")
-	blocks = []
-	for table_tag in soup.find_all("table"):
+	document = parse_html(ids_html, content=wiki_content)
+	tables = []
+	for table_tag in find_tags(document, "table"):
 		table = parse_table(table_tag, True)
 		if get_text(table.get(0, 0)) == "Icon":
-			extract_blocks_from_table(date_limit, table, blocks)
-	return blocks
+			tables.append(table)
+	return tables
 
 
-def extract_blocks_from_table(date_limit: date, table: HtmlTable, dest: list):
+def find_block_rows(table: HtmlTable):
+	"""Reads a table of the block IDs page and returns a list of (id, mc_name, nice_name, page) tuples."""
+	rows = []
 	for row in table.rows[1:]:
 		block_id = int(get_text(row[1]))
 		block_mc_name = get_text(row[3])
@@ -33,32 +50,56 @@ def extract_blocks_from_table(date_limit: date, table: HtmlTable, dest: list):
 			block_page = block_page.split("#")[0]
 		if block_page.startswith("/"):
 			block_page = block_page[1:]
+		rows.append((block_id, block_mc_name, block_nice_name, block_page))
+	return rows
 
-		# Gets the final url:
-		block_url = find_revision_url(real_page(block_page), date_limit)
 
-		# DEBUG
-		if block_url is None:
-			print("WARNING - No url found for block %s, page %s" % (block_mc_name, block_page))
-			continue
-		else:
-			print("Extracting block \"%s\" from page %s -> %s" % (block_nice_name, block_page, block_url))
+def find_block_urls(rows: list, date_limit: date, jobs: int = 1):
+	"""Finds the revisions of the blocks' pages at the given date, and returns a dict page -> url."""
+	urls = find_revision_urls([real_page(row[3]) for row in rows], date_limit, jobs=jobs)
+	return {row[3]: urls[real_page(row[3])] for row in rows}
+
 
-		# Constructs the blog:
-		block = gather_block_infos(block_id, block_mc_name, block_nice_name, block_url)
+def extract_blocks_from_table(date_limit: date, table: HtmlTable, dest: list, jobs: int = 1):
+	rows = find_block_rows(table)
+
+	# Gets the final urls, with a few batched queries:
+	block_urls = find_block_urls(rows, date_limit, jobs)
+
+	def extract_row(args):
+		return extract_block(*args, block_urls[args[3]])
+
+	# The pool's map() yields the results in the order of the rows, like a serial run
+	if jobs > 1:
+		with ThreadPoolExecutor(max_workers=jobs) as executor:
+			blocks = list(executor.map(extract_row, rows))
+	else:
+		blocks = map(extract_row, rows)
+	for block in blocks:
 		if block:
 			dest.append(block)
 
 
+def extract_block(block_id, block_mc_name, block_nice_name, block_page, block_url):
+	if block_url is None:
+		print("WARNING - No url found for block %s, page %s" % (block_mc_name, block_page))
+		return None
+	else:
+		print("Extracting block \"%s\" from page %s -> %s" % (block_nice_name, block_page, block_url))
+
+	# Constructs the blog:
+	return gather_block_infos(block_id, block_mc_name, block_nice_name, block_url)
+
+
 def gather_block_infos(block_id, block_mc_name, block_nice_name, block_url):
 	details_html = robust_request(block_url).text
-	soup = BeautifulSoup(details_html, "lxml")
-	sections = make_hierarchy(soup)
+	document = parse_html(details_html, content=wiki_content)
+	sections = make_hierarchy(document)
 	root = sections[0]
 
 	# Gets the block properties
 	props = {}
-	table_tag = soup.find("table", {"class": "infobox-rows"})
+	table_tag = next(find_tags(document, "table", "infobox-rows"), None)
 	if table_tag is None:
 		print("WARNING: Unable to find the properties of", block_mc_name)
 		return None
@@ -70,8 +111,8 @@ def gather_block_infos(block_id, block_mc_name, block_nice_name, block_url):
 		props[prop_name] = prop_value
 
 	# Gets the block hardness
-	obtain_section = root.recursive_find(lambda e: isinstance(e, HtmlSection) and e.html_id == "Obtaining")
-	obtain_table = obtain_section.find(lambda e: isinstance(e, HtmlTable)) if obtain_section else None
+	obtain_section = root.recursive_sub_id("Obtaining")
+	obtain_table = obtain_section.find_type(HtmlTable) if obtain_section else None
 	if obtain_table:
 		for row in obtain_table.rows:
 			prop_name = get_text(row[0]).strip().lower()
@@ -81,8 +122,8 @@ def gather_block_infos(block_id, block_mc_name, block_nice_name, block_url):
 
 	# Gets the data values, if any
 	data_values = []
-	data_section = root.recursive_find(lambda e: isinstance(e, HtmlSection) and e.html_id == "Block_data")
-	data_table = data_section.find(lambda e: isinstance(e, HtmlTable)) if data_section else None
+	data_section = root.recursive_sub_id("Block_data")
+	data_table = data_section.find_type(HtmlTable) if data_section else None
 	if data_table:
 		first_not_data = (data_table.column_count() > 2 and data_table.get(0, 0) == "")
 		value_col = 1 if first_not_data else 0
@@ -1,6 +1,7 @@
 import os
 
 import datatractor.main.blocks_extractor as b_extractor
+import datatractor.main.json_exporter as json_exporter
 import datatractor.main.packets_extractor as p_extractor
 import datatractor.main.scala_generator as generator
 
@@ -25,12 +26,17 @@ def get_release_infos(game_version: str):
 
 
 class PacketsExtractor:
-	def __init__(self, game_version: str):
+	def __init__(self, game_version: str, emit_json: bool = False):
 		self.name = "Packets Extractor"
 		self.game_version = game_version
+		self.emit_json = emit_json
 
 	def extract(self, output_dir):
 		protocol = p_extractor.extract_packets(self.game_version)
+		if self.emit_json:
+			print("Writing the protocol in JSON...")
+			os.makedirs(output_dir, exist_ok=True)
+			json_exporter.export_protocol(protocol, f"{output_dir}/protocol.json")
 		protocol_infos = f"protocol {protocol.number} for MC {protocol.game_version}"
 		wikivg_link = (protocol.doc_url, "Documentation at wiki.vg")
 		print("Generating Scala files...")
@@ -76,13 +82,14 @@ class PacketsExtractor:
 
 
 class BlocksExtractor:
-	def __init__(self, game_version: str):
+	def __init__(self, game_version: str, jobs: int = 1):
 		self.name = "Blocks Extractor"
 		self.game_version = game_version
+		self.jobs = jobs
 		a, b, self.next_date = get_release_infos(game_version)
 
 	def extract(self, output_dir):
-		blocks = b_extractor.extract_blocks(self.next_date)
+		blocks = b_extractor.extract_blocks(self.next_date, self.jobs)
 		f = open("%s/blocks_full_ids.json" % output_dir, "w")
 		f2 = open("%s/blocks_classic_ids.json" % output_dir, "w")
 		for block in blocks:
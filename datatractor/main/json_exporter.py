@@ -0,0 +1,151 @@
+from json.encoder import encode_basestring
+from math import inf
+
+from datatractor.main.packets_data import *
+
+_buffer_size = 4096  # the number of pieces of JSON to join before writing them
+
+
+def export_protocol(protocol: Protocol, file: str):
+	"""
+	Writes a protocol in a JSON file.
+	:param protocol: the protocol
+	:param file: the path of the file
+	"""
+	with open(file, "w", encoding="utf-8") as out:
+		write_json(protocol, out)
+
+
+def write_json(o, out):
+	"""
+	Writes the JSON of a protocol or of one of its parts, piece by piece.
+	The fields that are referred to by another element, like the field of an enum or the field that gives the length
+	of an array, are written as their name, to avoid the cycles.
+	:param o: the Protocol, SubProtocol, PacketInfos, Compound, SwitchEntry, Switch, Field, Enum or EnumEntry
+	:param out: the text stream
+	"""
+	stream = _JsonStream(out)
+	stream.value(o)
+	stream.flush()
+
+
+def to_json(o) -> str:
+	"""Returns the JSON of a protocol or of one of its parts, see write_json."""
+	stream = _JsonStream(None)
+	stream.value(o)
+	return "".join(stream.pieces)
+
+
+class _JsonStream:
+	"""Accumulates the pieces of JSON and writes them when there are enough of them, if there's an output."""
+	__slots__ = ("out", "pieces")
+
+	def __init__(self, out):
+		self.out = out
+		self.pieces = []
+
+	def flush(self):
+		self.out.write("".join(self.pieces))
+		self.pieces.clear()
+
+	def value(self, o):
+		pieces = self.pieces
+		if o is None:
+			pieces.append("null")
+		elif o is True:
+			pieces.append("true")
+		elif o is False:
+			pieces.append("false")
+		elif isinstance(o, str):
+			pieces.append(encode_basestring(o))
+		elif isinstance(o, int):
+			pieces.append(int.__repr__(o))  # not the repr of a subclass, like an IntEnum
+		elif isinstance(o, float):
+			if o != o or o in (inf, -inf):
+				raise ValueError(f"Cannot export the float {o!r} to JSON")
+			pieces.append(float.__repr__(o))
+		elif isinstance(o, list):
+			pieces.append("[")
+			first = True
+			for e in o:
+				if not first:
+					pieces.append(",")
+				first = False
+				self.value(e)
+			pieces.append("]")
+		else:
+			writer = _writers.get(type(o))
+			if writer is None:  # a subclass
+				writer = next((_writers[t] for t in type(o).__mro__ if t in _writers), None)
+				if writer is None:
+					raise TypeError(f"Cannot export {type(o).__name__} to JSON")
+			self.object(*writer(o))
+			if self.out is not None and len(pieces) >= _buffer_size:
+				self.flush()
+
+	def object(self, data_type: str, *items):
+		"""Writes a JSON object from (key, value) pairs."""
+		self.pieces.append(f'{{"dataType":"{data_type}"')
+		for key, value in items:
+			self.pieces.append(f',"{key}":')
+			self.value(value)
+		self.pieces.append("}")
+
+
+def _name(o):
+	return None if o is None else o.name
+
+
+# Each writer returns the data type and the (key, value) pairs of an element
+
+def _protocol(p: Protocol):
+	return "Protocol", ("docUrl", p.doc_url), ("gameVersion", p.game_version), ("number", p.number), \
+		   ("handshake", p.handshake), ("play", p.play), ("status", p.status), ("login", p.login)
+
+
+def _subprotocol(s: SubProtocol):
+	return "SubProtocol", ("name", s.name), ("clientBound", s.clientbound), ("serverBound", s.serverbound)
+
+
+def _packet(p: PacketInfos):
+	return "PacketInfos", ("id", p.main_id), ("compound", p.main_compound)
+
+
+def _compound(c: Compound):
+	return "Compound", ("name", c.name), ("field", _name(c.field)), ("entries", c.entries)
+
+
+def _switch_entry(e: SwitchEntry):
+	return "SwitchEntry", ("name", e.name), ("value", e.value), ("field", _name(e.field)), ("entries", e.entries)
+
+
+def _switch(s: Switch):
+	return "Switch", ("name", s.name), ("field", s.field.name), ("isRefOut", s.is_ref_out), ("entries", s.entries)
+
+
+def _field(f: Field):
+	# The switch is an entry of the compound that contains the field, the enum and the compound belong to the field
+	return "Field", ("name", f.name), ("type", f.type), ("comment", f.comment), \
+		   ("stringMaxLength", f.string_max_length), ("lengthGivenBy", _name(f.length_given_by)), \
+		   ("onlyIf", f.only_if), ("enum", f.enum), ("switch", _name(f.switch)), ("compound", f.compound)
+
+
+def _enum(e: Enum):
+	return "Enum", ("name", e.name), ("field", e.field.name), ("entries", e.entries)
+
+
+def _enum_entry(e: EnumEntry):
+	return "EnumEntry", ("name", e.name), ("value", e.value), ("comment", e.comment)
+
+
+_writers = {
+	Protocol: _protocol,
+	SubProtocol: _subprotocol,
+	PacketInfos: _packet,
+	Compound: _compound,
+	SwitchEntry: _switch_entry,
+	Switch: _switch,
+	Field: _field,
+	Enum: _enum,
+	EnumEntry: _enum_entry,
+}
@@ -1,7 +1,12 @@
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
-from utils.html_tools import *
-from utils.string_tools import *
+from datatractor.utils.html_tools import *
+from datatractor.utils.string_tools import *
+
+
+def _to_json(o):
+	from datatractor.main.json_exporter import to_json  # the exporter imports this module
+	return to_json(o)
 
 
 class Field:
@@ -42,18 +47,7 @@ class Field:
 		return f"Field({self.name}: {self.type}{maxlen}{lengiv}{comment})"
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "Field",' \
-			   f'"name": "{self.name}",' \
-			   f'"type": "{self.type}",' \
-			   f'"comment": "{self.comment}",' \
-			   f'"stringMaxLength": {jsonize(self.string_max_length)},' \
-			   f'"lengthGivenBy": {"null" if self.length_given_by is None else jsonize(self.length_given_by.name)}' \
-			   f'"onlyIf": {"null" if self.only_if is None else jsonize(self.only_if)}' \
-			   f'"enum": {jsonize(self.enum)},' \
-			   f'"switch": {jsonize(self.switch)},' \
-			   f'"compound": {jsonize(self.compound)}' \
-			   f'}}'
+		return _to_json(self)
 
 	def set_length_given_by(self, field):
 		self.length_given_by = field
@@ -87,12 +81,7 @@ class Compound:
 		return len(self.entries) == 0
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "Compound",' \
-			   f'"name": "{self.name}",' \
-			   f'"field": {jsonize(self.field)},' \
-			   f'"entries": {jsonize(self.entries)}' \
-			   f'}}'
+		return _to_json(self)
 
 
 class SwitchEntry(Compound):
@@ -106,13 +95,7 @@ class SwitchEntry(Compound):
 		return f"SwitchEntry({self.value} => {self.name})"
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "SwitchEntry",' \
-			   f'"name": "{self.name}",' \
-			   f'"value": {jsonize(self.value)}' \
-			   f'"field": {jsonize(self.field)},' \
-			   f'"entries": {jsonize(self.entries)}' \
-			   f'}}'
+		return _to_json(self)
 
 
 class Switch:
@@ -135,12 +118,7 @@ class Switch:
 		return f"Switch{self.entries}"
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "Switch",' \
-			   f'"name": "{self.name}",' \
-			   f'"field": {jsonize(self.field)},' \
-			   f'"entries": {jsonize(self.entries)}' \
-			   f'}}'
+		return _to_json(self)
 
 
 class EnumEntry:
@@ -153,12 +131,7 @@ class EnumEntry:
 		return f"EnumEntry({self.name} = {self.value})"
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "EnumEntry",' \
-			   f'"name": "{self.name}",' \
-			   f'"value": {jsonize(self.value)},' \
-			   f'"comment": {jsonize(self.comment)}' \
-			   f'}}'
+		return _to_json(self)
 
 
 _imposed_names = {
@@ -182,12 +155,7 @@ class Enum:
 		self.entries.append(entry)
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "Enum",' \
-			   f'"name": "{self.name}",' \
-			   f'"field": {jsonize(self.field)},' \
-			   f'"entries": {jsonize(self.entries)}' \
-			   f'}}'
+		return _to_json(self)
 
 
 class Protocol:
@@ -211,14 +179,7 @@ class Protocol:
 			self.game_version, self.number, str(self.handshake), str(self.play), str(self.status), str(self.login))
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "Protocol",' \
-			   f'"gameVersion": "{self.game_version}",' \
-			   f'"number": {self.number},' \
-			   f'"play": {jsonize(self.play)},' \
-			   f'"status": {jsonize(self.status)},' \
-			   f'"login": {jsonize(self.login)}' \
-			   f'}}'
+		return _to_json(self)
 
 
 class SubProtocol:
@@ -240,12 +201,7 @@ class SubProtocol:
 		return len(self.clientbound) + len(self.serverbound)
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "SubProtocol",' \
-			   f'"name": "{self.name}",' \
-			   f'"clientBound": {jsonize(self.clientbound)},' \
-			   f'"serverBound": {jsonize(self.serverbound)},' \
-			   f'}}'
+		return _to_json(self)
 
 
 class PacketInfos:
@@ -259,22 +215,83 @@ class PacketInfos:
 	main_id: int
 	dict_fields: Dict[str, Field]
 	all_fields: List[Field]  # contains all the fields we've found
+	field_matcher: KeywordMatcher  # finds the fields' lower-case names in a text
 
 	def __init__(self, section: HtmlSection):
-		self.section = section
 		t: HtmlTable
 		i: int
-		t, i = section.find_i(lambda x: isinstance(x, HtmlTable))
-		self.main_table = t
-		self.below_main = section.content[i + 1:]
-		self.main_compound = Compound(classname(section.title))
-		self.main_id = int(get_text(t.get(1, 0)), base=0)  # second row first column
+		t, i = section.find_type_i(HtmlTable)
+		main_id = int(get_text(t.get(1, 0)), base=0)  # second row first column
+		self._init(section, t, section.content[i + 1:], Compound(classname(section.title)), main_id)
+
+	@classmethod
+	def without_section(cls, name: str, packet_id: int):
+		"""
+		Creates a packet that isn't read from the documentation, without any field yet.
+		:param name: the name of its compound
+		:param packet_id: its id
+		"""
+		p = cls.__new__(cls)
+		p._init(None, None, [], Compound(name), packet_id)
+		return p
+
+	def _init(self, section: Optional[HtmlSection], main_table: Optional[HtmlTable], below_main: List[Any],
+			  main_compound: Compound, main_id: int):
+		self.section = section
+		self.main_table = main_table
+		self.below_main = below_main
+		self.main_compound = main_compound
+		self.main_id = main_id
 		self.all_fields = []
 		self.dict_fields = {}
+		self.field_matcher = KeywordMatcher()
+		self._field_order = {}  # id(field) -> index in all_fields
 
 	def register_field(self, field: Field):
+		self._field_order[id(field)] = len(self.all_fields)
 		self.all_fields.append(field)
 		self.dict_fields[field.name.lower()] = field
+		self.field_matcher.add(field.name.lower(), field)
+
+	def rename_field(self, field: Field, name: str):
+		"""
+		Renames a registered field. dict_fields keeps its old name, which is the one used in the documentation.
+		"""
+		self.field_matcher.remove(field.name.lower(), field)
+		field.name = name
+		self.field_matcher.add(name.lower(), field)
+
+	def fields_by_length(self):
+		"""Returns the fields with the longest names first, which are the most specific when searching for a field."""
+		return sorted(self.all_fields, key=lambda f: len(f.name), reverse=True)
+
+	def find_mentioned_field(self, text: str, names: List[str], accept: Callable[[Field], bool]):
+		"""
+		Finds the field with the longest name that occurs in the text or is one of the names, among the accepted ones.
+		It gives the same field as the first accepted one of fields_by_length() whose name matches, without scanning
+		all the fields.
+		:param text: the lower-case text to search
+		:param names: the lower-case names to compare exactly
+		:param accept: the fields' filter
+		:return: the field, or None
+		"""
+		keywords = self.field_matcher.find(text)
+		keywords.update(name for name in names if name in self.field_matcher.values)
+		best = None
+		best_key = None
+		for keyword in keywords:
+			for field in self.field_matcher.values[keyword]:
+				key = (-len(field.name), self._field_order[id(field)])
+				if (best is None or key < best_key) and accept(field):
+					best, best_key = field, key
+		return best
+
+	def strip(self):
+		"""Drops the HTML data and the index of the fields, once the packet is analysed."""
+		self.section = None
+		self.main_table = None
+		self.below_main = None
+		self.field_matcher = None
 
 	def name(self):
 		return self.main_compound.name
@@ -283,11 +300,7 @@ class PacketInfos:
 		return self.main_id
 
 	def json(self):
-		return f'{{' \
-			   f'"dataType": "PacketInfos",' \
-			   f'"id": {self.main_id},' \
-			   f'"compound": {self.main_compound.json()},' \
-			   f'}}'
+		return _to_json(self)
 
 
 class LocalContext:
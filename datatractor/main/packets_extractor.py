@@ -1,12 +1,76 @@
-from math import inf
+import gzip
+import io
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+from datatractor.main.packets_data import *
+from datatractor.main.packets_rules import find_enum_start, match_guard, guard_operators, rule_hits, switch_entry
+from datatractor.utils import html_tools
+from datatractor.utils.http_tools import robust_request
+
+subprotocol_ids = ["Handshaking", "Play", "Status", "Login"]  # the sections of the documentation that are analysed
+EXTRACTOR_VERSION = 1  # to increment when the analysis changes, to invalidate the cached protocols
+ir_cache = None  # the directory of the analysed protocols, see install_ir_cache, or None to disable the cache
+pool = None  # the processes that analyse the packets, see install_pool, or None to analyse them in this process
+pool_size = 1
+# Below this number of packets per process, sending the sections to the workers costs more than the parallel analysis
+# saves. The parent pickles each section and unpickles each packet in about half the time of its analysis, and each
+# chunk costs a round trip, so 4 processes engage from 64 packets, like the 100+ of the Play state
+min_packets_per_process = 16
+
+
+def install_ir_cache(directory: str):
+	"""Enables the cache of the analysed protocols, stored in the given directory."""
+	global ir_cache
+	os.makedirs(directory, exist_ok=True)
+	ir_cache = directory
+
+
+def ir_path(game_version: str, url: str):
+	"""
+	Returns the file of the protocol analysed from the given revision of the documentation, or None if the url doesn't
+	name a fixed revision or if the cache is disabled.
+	The file depends on the versions of the extractor and of the parser, and on the parser's backend, since they all
+	change the analysed protocol.
+	"""
+	m = re.search("[?&]oldid=(\\d+)", url)
+	if ir_cache is None or m is None:
+		return None
+	versions = f"v{EXTRACTOR_VERSION}-{html_tools.backend}-v{html_tools.PARSER_VERSION}"
+	return os.path.join(ir_cache, f"protocol-{game_version}-{m.group(1)}-{versions}.pickle.gz")
+
+
+def load_protocol(path: str):
+	"""Loads a protocol saved by save_protocol, or returns None if there's none."""
+	if path is None or not os.path.isfile(path):
+		return None
+	try:
+		with open(path, "rb") as f:
+			return pickle.loads(gzip.decompress(f.read()))
+	except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+		print("WARNING - Ignoring the invalid cached protocol %s: %s" % (path, e))
+		return None
 
-import requests
 
-from main.packets_data import *
+def save_protocol(protocol, path: str):
+	"""Saves a protocol, without the documentation's sections, which aren't needed to generate the code."""
+	for sub in [protocol.handshake, protocol.play, protocol.status, protocol.login]:
+		for packet in sub.clientbound + sub.serverbound:
+			packet.strip()
+	tmp = f"{path}.{os.getpid()}.tmp"
+	with open(tmp, "wb") as f:
+		f.write(gzip.compress(pickle.dumps(protocol, pickle.HIGHEST_PROTOCOL)))
+	os.replace(tmp, path)
 
 
 def extract_packets(game_version: str):
-	"""Extracts packet data from wiki.vg"""
+	"""
+	Extracts packet data from wiki.vg, with the pool of processes if install_pool has started one
+	:param game_version: the game version
+	"""
 	print("Looking for the documentation of protocol", game_version, "...")
 	url, protocol_number = find_documentation(game_version)
 
@@ -16,9 +80,13 @@ def extract_packets(game_version: str):
 
 	print("Found url:", url)
 	print("Protocol number:", protocol_number)
+	protocol = load_protocol(ir_path(game_version, url))
+	if protocol is not None:
+		print("Using the protocol analysed by a previous run")
+		return protocol
 
 	print("Downloading the documentation...")
-	protocol_html = requests.get(url).text
+	protocol_html = robust_request(url).text
 
 	# If we're using the last revision of the page, find its id and create a URL that will stay valid in the future
 	if "id=" not in url and '"wgRevisionId":' in protocol_html:
@@ -26,24 +94,31 @@ def extract_packets(game_version: str):
 		page_id = protocol_html[i:i + 10].split(',', maxsplit=1)[0].strip()
 		url = url.replace("wiki.vg/", "wiki.vg/index.php?title=") + "&oldid=" + page_id
 		print("Created future-proof url: ", url)
+		protocol = load_protocol(ir_path(game_version, url))
+		if protocol is not None:
+			print("Using the protocol analysed by a previous run")
+			return protocol
 
 	print("Organizing the data...")
-	soup = BeautifulSoup(protocol_html, "lxml")
-	sections = make_hierarchy(soup)
+	sections = cached_hierarchy(protocol_html, wiki_content, ids=subprotocol_ids)  # the other tables aren't parsed
 	root = sections[0]
 
 	print("Analysing the protocol...")
+	rule_hits.clear()
 	protocol = extract_protocol(url, root, game_version, protocol_number)
+	print("Heuristics used:", ", ".join(f"{name} x{n}" for name, n in rule_hits.most_common()))
+	path = ir_path(game_version, url)
+	if path is not None:
+		save_protocol(protocol, path)
 	return protocol
 
 
 def find_documentation(game_version: str):
 	print("---------------------------")
-	html = requests.get("http://wiki.vg/Protocol_version_numbers").text
-	root = make_hierarchy(BeautifulSoup(html, "lxml"))[0]
+	html = robust_request("http://wiki.vg/Protocol_version_numbers").text
+	root = make_hierarchy(parse_html(html, content=wiki_content))[0]
 	table: HtmlTable
-	ll = list(root.recursive_findall(lambda e: isinstance(e, HtmlTable)))
-	for table in root.recursive_findall(lambda e: isinstance(e, HtmlTable)):
+	for table in root.recursive_findall_type(HtmlTable):
 		for row in table.rows[1:]:
 			release_name = get_text(row[0])
 			protocol = get_text(row[1])
@@ -63,10 +138,7 @@ def find_documentation(game_version: str):
 
 
 def extract_protocol(doc_url: str, root: HtmlSection, game_version: str, protocol_number: int):
-	s_handshake = root.sub_id("Handshaking")
-	s_play = root.sub_id("Play")
-	s_status = root.sub_id("Status")
-	s_login = root.sub_id("Login")
+	s_handshake, s_play, s_status, s_login = (root.sub_id(html_id) for html_id in subprotocol_ids)
 
 	p_handshake = extract_subprotocol(s_handshake)
 	p_play = extract_subprotocol(s_play)
@@ -76,14 +148,70 @@ def extract_protocol(doc_url: str, root: HtmlSection, game_version: str, protoco
 	return Protocol(doc_url, game_version, protocol_number, p_handshake, p_play, p_status, p_login)
 
 
+def install_pool(processes: int):
+	"""
+	Starts the pool of processes that analyse the packets, if processes > 1.
+	The workers are forked right away, because spawning them would run the main script again. So this must be called
+	before any thread is started: the forked workers would get the locks held by the other threads, like the ones of
+	the HTTP session and of the rate limiter, without the threads that release them.
+	"""
+	global pool, pool_size
+	if processes <= 1:
+		return
+	context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+	pool = ProcessPoolExecutor(processes, context)
+	pool.submit(int).result()  # the fork context starts all the workers on the first task
+	pool_size = processes
+
+
+def pool_chunksize(packets: int):
+	"""
+	Returns the number of packets to send to a worker at once, or 0 if the packets are too few to be worth the pool.
+	The chunks are large, since each one costs a round trip, but there are several per worker to balance the load.
+	"""
+	if pool is None or packets < pool_size * min_packets_per_process:
+		return 0
+	return -(-packets // (pool_size * 4))
+
+
 def extract_subprotocol(s: HtmlSection):
+	"""
+	Extracts the packets of a subprotocol, in the order of the documentation.
+	The packets are analysed by the pool of processes when there are enough of them, see pool_chunksize. The sections
+	are sent to the workers, so they must be detached (see make_hierarchy).
+	:param s: the section of the subprotocol
+	:return: the SubProtocol
+	"""
 	subprotocol_name = s.title
 	s_clientbound = s.sub_title("Clientbound")
 	s_serverbound = s.sub_title("Serverbound")
+	cb_sections = [] if (s_clientbound is None) else list(s_clientbound.subs())
+	sb_sections = [] if (s_serverbound is None) else list(s_serverbound.subs())
 
-	cb = [] if (s_clientbound is None) else [extract_packet(section) for section in s_clientbound.subs()]
-	sb = [] if (s_serverbound is None) else [extract_packet(section) for section in s_serverbound.subs()]
-	return SubProtocol(subprotocol_name, cb, sb)
+	chunksize = pool_chunksize(len(cb_sections) + len(sb_sections))
+	if chunksize == 0:
+		packets = [extract_packet(section) for section in cb_sections + sb_sections]
+	else:
+		# The workers' logs are printed in order, like a serial run
+		packets = []
+		for packet, log, hits in pool.map(extract_packet_logged, cb_sections + sb_sections, chunksize=chunksize):
+			print(log, end="")
+			packets.append(packet)
+			rule_hits.update(hits)
+	return SubProtocol(subprotocol_name, packets[:len(cb_sections)], packets[len(cb_sections):])
+
+
+def extract_packet_logged(section: HtmlSection):
+	"""
+	Runs extract_packet and returns the packet with what it printed and the hits of the packets_rules.
+	The packet is stripped, since its HTML data would more than double the size of the result sent back.
+	"""
+	log = io.StringIO()
+	rule_hits.clear()
+	with redirect_stdout(log):
+		p = extract_packet(section)
+	p.strip()
+	return p, log.getvalue(), rule_hits.copy()
 
 
 def extract_packet(section: HtmlSection):
@@ -108,7 +236,6 @@ def extract_packet(section: HtmlSection):
 
 
 def parse_compound(ctx: LocalContext, p: PacketInfos, row, compound, nrows):
-	global idx0
 	end = row + nrows
 	assert end <= ctx.rowlimit, f"Invalid end {end} = {row} + {nrows} for compound {compound}"
 
@@ -146,7 +273,7 @@ def parse_compound(ctx: LocalContext, p: PacketInfos, row, compound, nrows):
 		field_notes = get_text(notes_cell)
 		# Switch entry ------------------------------------------
 		# The switch is detected before the "no field" condition, otherwise we miss a few switch entries
-		if re.fullmatch("\\d+\\s*:.+", low_field_name):
+		if switch_entry.fullmatch(low_field_name):
 			if current_switch is None:  # new switch
 				if switch_field is None:  # should NOT happen
 					print(f"[ERROR] Invalid switch: no corresponding field")
@@ -201,7 +328,7 @@ def parse_compound(ctx: LocalContext, p: PacketInfos, row, compound, nrows):
 					field.set_length_given_by(length_field)
 					length_field_force = 0
 					if length_field.name in ["length", "count", "size"]:  # ambiguous short name and maybe duplicated
-						length_field.name = f"{field.name}Length"  # meaningful and unique name
+						p.rename_field(length_field, f"{field.name}Length")  # meaningful and unique name
 
 				# Parse the compound structure
 				compound_nested = Compound(compound_name, field)
@@ -229,7 +356,7 @@ def parse_compound(ctx: LocalContext, p: PacketInfos, row, compound, nrows):
 						length_field_force = 0
 						if length_field.name in ["length", "count", "size"]:
 							# ambiguous short name and maybe duplicated => meaningful and unique name
-							length_field.name = f"{field.name}Length"
+							p.rename_field(length_field, f"{field.name}Length")
 
 				# Handle optional fields
 				if is_optional(field):
@@ -270,48 +397,10 @@ def parse_compound(ctx: LocalContext, p: PacketInfos, row, compound, nrows):
 				else:
 					option_guard_field = field
 
-				# Detect if the field is an enum with values defined in the field's notes
-				# ... And admire the different syntaxes used in the documentation ><
+				# Detect if the field is an enum with values defined in the field's notes, see packets_rules
 				idx0 = None
 				if field_notes is not None:
-					if "-1:" in field_notes:
-						idx0 = field_notes.index("-1:")
-					elif "0:" in field_notes:
-						idx0 = field_notes.index("0:")
-					elif "0 :" in field_notes:
-						idx0 = field_notes.index("0 :")
-					elif "0x1:" in field_notes and "0x2:" in field_notes:
-						# This a bitmask but we store its values the same way as an enum
-						# The generator won't generate a real "enum" but a class with constants values so it's fine
-						idx0 = field_notes.index("0x1:")
-					elif "0xF0 =" in field_notes:  # priority over "0 ="
-						is_semi_byte_a = (field_notes.count('=') == 2) and ("0x0F" in field_notes)
-						is_semi_byte_b = "4 most significant bits" in field_notes
-						if not is_semi_byte_a and not is_semi_byte_b:
-							idx0 = field_notes.index("0xF0 =")
-							field_notes = field_notes.replace(" =", ':').replace('=', ':')
-					elif "0 =" in field_notes and not "20 = full" in field_notes:
-						idx1 = field_notes.index("1 =") if "1 =" in field_notes else inf
-						idx0 = field_notes.index("0 =")
-						idx0 = min(idx0, idx1)
-						field_notes = field_notes.replace(" =", ':').replace('=', ':')
-					elif "0=" in field_notes and "from y=0" not in field_notes:
-						idx1 = field_notes.index("1=") if "1=" in field_notes else inf
-						idx0 = field_notes.index("0=")
-						idx0 = min(idx0, idx1)
-						field_notes = field_notes.replace(" =", ':').replace('=', ':')
-					elif "1 for" in field_notes and "1 for every" not in field_notes:
-						idx0 = field_notes.index("1 for")
-						field_notes = field_notes.replace(" for", ':')
-					elif "North =" in field_notes and "," in field_notes:
-						idx0 = field_notes.index("North =")
-						field_notes = field_notes.replace("North = 2, South = 0, West = 1, East = 3",
-														  "0: South, 1: West, 2: North, 3: East")
-					elif "1 -" in field_notes and ("2 -" in field_notes or "0 -" in field_notes):
-						idx1 = field_notes.index("1 -")
-						idx0 = field_notes.index("0 -") if "0 -" in field_notes else inf
-						idx0 = min(idx0, idx1)
-						field_notes = field_notes.replace(" -", ':').replace('-', ':')
+					idx0, field_notes = find_enum_start(field_notes)
 
 				# Enum in notes ---------------------
 				if idx0 is not None:
@@ -371,41 +460,29 @@ def find_guard_value(guard: Field, value: str):
 
 
 def find_guard_condition(p: PacketInfos, field: Field, guard: Field, c: str):
-	m = re.match("(.+) is (.+) or (.+)", c)
-	if m is not None:
-		g = p.dict_fields.get(varname(snake_case(m.group(1))))
+	rule, m = match_guard(c)
+	if rule == "either":
+		rule_hits[rule] += 1
+		g = p.dict_fields.get(varname(snake_case(m.group("either_guard"))))
 		guard = g if g is not None else guard
-		return f"{guard.name} == {m.group(2)} || {guard.name} == {m.group(3)}"
+		return f"{guard.name} == {m.group('either_value')} || {guard.name} == {m.group('either_value2')}"
 
 	if "indicates it" in c and guard.enum is not None and len(guard.enum.entries) > 0:
+		rule_hits["indicates"] += 1
 		return f"{guard.name} & {guard.enum.entries[0].name} != 0"
 
-	operator = None
-	m = re.match("(.+) does not equal (.+)", c)
-	if m is not None:
-		operator = "!="
-	else:
-		m = re.match("(.+) is more than (.+)", c)
-		if m is not None:
-			operator = ">"
-		else:
-			m = re.match("(.+) is less than (.+)", c)
-			if m is not None:
-				operator = "<"
-			else:
-				m = re.match("(.+) is (.+)", c)
-				if m is not None:
-					operator = "=="
-				else:
-					return None
+	if m is None:
+		return None
+	rule_hits[rule] += 1
+	operator = guard_operators[rule]
 
-	specified_guard_name = m.group(1)
+	specified_guard_name = m.group(f"{rule}_guard")
 	g = p.dict_fields.get(varname(snake_case(specified_guard_name)))
 	guard = g if g is not None else guard
 	if guard is None:
 		return None
 
-	specified_value = m.group(2)
+	specified_value = m.group(f"{rule}_value")
 	value = find_guard_value(guard, specified_value)
 	if value is None:
 		return None
@@ -423,8 +500,6 @@ def can_be_related(field: Field, is_enum: bool):
 
 
 def parse_below(p: PacketInfos):
-	# Put the longer names first to get the most specific result when searching for the related field:
-	fields = sorted(p.all_fields, key=lambda f: len(f.name), reverse=True)
 	last: str = ""
 	for elem in p.below_main:
 		if isinstance(elem, HtmlTable):
@@ -435,38 +510,38 @@ def parse_below(p: PacketInfos):
 			is_attr = (attribute_columns is not None)
 
 			# Find the related field
-			row0: List[str] = [get_text(cell).lower() for cell in elem.rows[0] if not cell.is_deleted]
-			compatible_fields = [(f, f.name.lower()) for f in fields if can_be_related(f, is_enum)]
-			related_field: Field = None
-			for (field, name) in compatible_fields:
-				if name in last or name in row0:
-					related_field = field
-					break
-			if related_field is None:  # Try harder
+			row0: List[str] = [(get_text(cell) or "").lower() for cell in elem.rows[0] if cell and not cell.is_deleted]
+			# The field with the longest name mentioned in the last text or in the headers is the most specific
+			related_field: Field = p.find_mentioned_field(last, row0, lambda f: can_be_related(f, is_enum))
+			if related_field is None:
+				# Put the longer names first to get the most specific result when searching for the related field:
+				fields = p.fields_by_length()
+				compatible_fields = [(f, f.name.lower()) for f in fields if can_be_related(f, is_enum)]
+				# Try harder
 				for (field, name) in compatible_fields:
 					if last in name:
 						related_field = field
 						break
-			if related_field is None:  # Retry harder
-				l = last.replace(' ', "")
-				for (field, name) in compatible_fields:
-					# DEBUG print(f"{name}: {field.type} ?")
-					if l in field.type.lower():
-						related_field = field
-						break
-			if related_field is None and is_enum:
-				print(f"[WARNING] Last resort to find the related field. Compatible fields: {compatible_fields}")
-				for (field, name) in compatible_fields:
-					if "type" in name:
-						for header in row0:
-							if "type" in header:
-								related_field = field
-								break
-					elif "id" in name:
-						for header in row0:
-							if "id" in header:
-								related_field = field
-								break
+				if related_field is None:  # Retry harder
+					l = last.replace(' ', "")
+					for (field, name) in compatible_fields:
+						# DEBUG print(f"{name}: {field.type} ?")
+						if l in field.type.lower():
+							related_field = field
+							break
+				if related_field is None and is_enum:
+					print(f"[WARNING] Last resort to find the related field. Compatible fields: {compatible_fields}")
+					for (field, name) in compatible_fields:
+						if "type" in name:
+							for header in row0:
+								if "type" in header:
+									related_field = field
+									break
+						elif "id" in name:
+							for header in row0:
+								if "id" in header:
+									related_field = field
+									break
 			# Parse the data
 			# Attribute data ------------------------
 			if is_attr:
@@ -474,7 +549,7 @@ def parse_below(p: PacketInfos):
 					print(">" * 30)
 					print(f"[ERROR] Attributes-like table found without a corresponding field")
 					print(f"Last text: {last}")
-					print(f"Fields: {[(f.name, f.type) for f in fields]}")
+					print(f"Fields: {[(f.name, f.type) for f in p.fields_by_length()]}")
 					print(f"Row0: {row0}")
 					print(f"Table: {elem}")
 					print("<" * 30)
@@ -504,7 +579,7 @@ def parse_below(p: PacketInfos):
 					print(">" * 30)
 					print(f"[ERROR] Enum-like table found without a corresponding field")
 					print(f"Last text: {last}")
-					print(f"Fields: {[(f.name, f.type) for f in fields]}")
+					print(f"Fields: {[(f.name, f.type) for f in p.fields_by_length()]}")
 					print(f"Row0: {row0}")
 					print(f"Table: {elem}")
 					print("<" * 30)
@@ -520,7 +595,7 @@ def parse_below(p: PacketInfos):
 						values_col = 0
 						row1 = [get_text(cell) for cell in elem.rows[1]]
 						for icol, content in enumerate(row1):
-							c = content.strip()
+							c = (content or "").strip()
 							if re.match("\\d+", c):
 								if re.fullmatch("\\d+:.+", c):
 									names_with_values = True
@@ -587,7 +662,7 @@ def parse_below(p: PacketInfos):
 					print(">" * 30)
 					print("[ERROR] Compound-like table found without a corresponding field")
 					print(f"Last text: {last}")
-					print(f"Fields: {[(f.name, f.type) for f in fields]}")
+					print(f"Fields: {[(f.name, f.type) for f in p.fields_by_length()]}")
 					print(f"Row0: {row0}")
 					print(f"Table: {elem}")
 					print("<" * 30)
@@ -600,8 +675,7 @@ def parse_below(p: PacketInfos):
 						compound_name = t
 					compound = Compound(compound_name, related_field)
 					parse_compound(ctx, p, row=1, compound=compound, nrows=ctx.rowlimit - 1)
-					# Recreate the field list to include the fields of the new compound:
-					fields = sorted(p.all_fields, key=lambda f: len(f.name), reverse=True)
+					# The new compound's fields are in the index now
 			last = ""
 		# Enum data in list -------------------------
 		# (often used in the old protocol documentation)
@@ -704,8 +778,8 @@ def find_compound_columns(table: HtmlTable):
 	i = 0
 	while i < ncol:
 		cell = first_row[i]
-		if not isinstance(cell, RefCell):
-			text = get_text(cell).strip().lower()
+		if cell is not None and not isinstance(cell, RefCell):
+			text = (get_text(cell) or "").strip().lower()
 			if text == "field name":
 				names_col = i
 			elif text == "field type":
@@ -721,7 +795,7 @@ def find_compound_columns(table: HtmlTable):
 def find_attribute_columns(table: HtmlTable):
 	if table.column_count() != 5:
 		return None
-	r = [get_text(cell).lower() for cell in table.rows[0]]
+	r = [(get_text(cell) or "").lower() for cell in table.rows[0]]
 	if r == ["key", "default", "min", "max", "label"]:
 		return 0, 1, 2, 3, 4
 	else:
@@ -0,0 +1,147 @@
+import re
+from collections import Counter
+from math import inf
+from typing import Callable, Optional, Tuple
+
+rule_hits = Counter()  # the number of times each rule has matched, by rule name
+
+switch_entry = re.compile("\\d+\\s*:.+")  # the name of a switch entry, like "0: name"
+
+
+class EnumRule:
+	"""
+	A way of writing the values of an enum in the notes of a field.
+	The rule matches the notes that contain its key and satisfy its condition. Then, its action returns the index of
+	the first entry in the notes, or None if they don't contain an enum after all, and the notes rewritten in the
+	"value: name" syntax.
+	"""
+	__slots__ = ("name", "key", "condition", "action")
+
+	def __init__(self, name: str, key: str, condition: Optional[Callable[[str], bool]] = None,
+				 action: Optional[Callable[[str], Tuple[Optional[int], str]]] = None):
+		self.name = name
+		self.key = key
+		self.condition = condition
+		self.action = action
+
+	def matches(self, notes: str):
+		return self.key in notes and (self.condition is None or self.condition(notes))
+
+	def apply(self, notes: str):
+		if self.action is None:
+			return notes.index(self.key), notes
+		return self.action(notes)
+
+	def __repr__(self):
+		return f"EnumRule({self.name}, {self.key!r})"
+
+
+def _first_of(notes: str, key: str, other: str, separator: str):
+	"""Returns the index of the first key, or other if it comes before, and replaces the separator by ':'."""
+	idx1 = notes.index(other) if other in notes else inf
+	idx0 = min(notes.index(key), idx1)
+	return idx0, notes.replace(f" {separator}", ':').replace(separator, ':')
+
+
+def _semi_byte(notes: str):
+	# A byte made of two values, not an enum
+	is_semi_byte_a = (notes.count('=') == 2) and ("0x0F" in notes)
+	is_semi_byte_b = "4 most significant bits" in notes
+	if is_semi_byte_a or is_semi_byte_b:
+		return None, notes
+	return notes.index("0xF0 ="), notes.replace(" =", ':').replace('=', ':')
+
+
+def _dashes(notes: str):
+	idx1 = notes.index("1 -")
+	idx0 = notes.index("0 -") if "0 -" in notes else inf
+	return min(idx0, idx1), notes.replace(" -", ':').replace('-', ':')
+
+
+# The rules are tried in this order, the first matching one is applied.
+# ... And admire the different syntaxes used in the documentation ><
+enum_rules = [
+	EnumRule("minus_one_colon", "-1:"),
+	EnumRule("zero_colon", "0:"),
+	EnumRule("zero_space_colon", "0 :"),
+	# This a bitmask but we store its values the same way as an enum
+	# The generator won't generate a real "enum" but a class with constants values so it's fine
+	EnumRule("bitmask", "0x1:", lambda notes: "0x2:" in notes),
+	EnumRule("semi_byte", "0xF0 =", action=_semi_byte),  # priority over "0 ="
+	EnumRule("zero_space_equals", "0 =", lambda notes: "20 = full" not in notes,
+			 lambda notes: _first_of(notes, "0 =", "1 =", "=")),
+	EnumRule("zero_equals", "0=", lambda notes: "from y=0" not in notes,
+			 lambda notes: _first_of(notes, "0=", "1=", "=")),
+	EnumRule("one_for", "1 for", lambda notes: "1 for every" not in notes,
+			 lambda notes: (notes.index("1 for"), notes.replace(" for", ':'))),
+	EnumRule("directions", "North =", lambda notes: "," in notes,
+			 lambda notes: (notes.index("North ="), notes.replace("North = 2, South = 0, West = 1, East = 3",
+																  "0: South, 1: West, 2: North, 3: East"))),
+	EnumRule("dashes", "1 -", lambda notes: "2 -" in notes or "0 -" in notes, _dashes),
+]
+
+# Finds the first key, to reject most notes quickly
+_enum_any_key = re.compile("|".join(re.escape(rule.key) for rule in enum_rules))
+# Then finds all the keys from there, in the same pass over the notes. The lookahead lets the keys overlap, like
+# "0xF0 =" and "0 ="; since no key is a prefix of another, at most one of them matches at each position, and
+# m.lastgroup gives its rule. The leading character set skips the positions where no key starts
+_enum_key_starts = "".join(sorted({re.escape(rule.key[0]) for rule in enum_rules}))
+_enum_keys = re.compile(f"(?=[{_enum_key_starts}])(?="
+						+ "|".join(f"(?P<{rule.name}>{re.escape(rule.key)})" for rule in enum_rules) + ")")
+_enum_rules = {rule.name: rule for rule in enum_rules}
+_enum_priorities = {rule.name: i for i, rule in enumerate(enum_rules)}
+
+
+def find_enum_rule(notes: str):
+	"""
+	Finds the first rule that matches the notes of a field. Unlike find_enum_start, it doesn't count the hit.
+	:return: the EnumRule, or None if the notes don't define an enum
+	"""
+	# Every key but "North =" contains a 0 or a 1, so these checks reject most notes faster than the regex
+	if "0" not in notes and "1" not in notes and "North =" not in notes:
+		return None
+	first = _enum_any_key.search(notes)
+	if first is None:
+		return None
+	found = {m.lastgroup for m in _enum_keys.finditer(notes, first.start())}
+	for name in sorted(found, key=_enum_priorities.__getitem__):
+		rule = _enum_rules[name]
+		if rule.condition is None or rule.condition(notes):
+			return rule
+	return None
+
+
+def find_enum_start(notes: str):
+	"""
+	Finds where the enum defined in the notes of a field begins, and counts the hit of the applied rule in rule_hits.
+	:return: (index, notes) where notes is rewritten in the "value: name" syntax, or (None, notes) if there's no enum
+	"""
+	rule = find_enum_rule(notes)
+	if rule is None:
+		return None, notes
+	rule_hits[rule.name] += 1
+	return rule.apply(notes)
+
+
+# The conditions written in the notes of the optional fields, as (name, pattern, operator), in order of priority
+guard_rules = [
+	("either", "(?P<either_guard>.+) is (?P<either_value>.+) or (?P<either_value2>.+)", "||"),
+	("not_equal", "(?P<not_equal_guard>.+) does not equal (?P<not_equal_value>.+)", "!="),
+	("more_than", "(?P<more_than_guard>.+) is more than (?P<more_than_value>.+)", ">"),
+	("less_than", "(?P<less_than_guard>.+) is less than (?P<less_than_value>.+)", "<"),
+	("equal", "(?P<equal_guard>.+) is (?P<equal_value>.+)", "=="),
+]
+guard_operators = {name: operator for name, pattern, operator in guard_rules}
+_guard_patterns = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern, operator in guard_rules))
+
+
+def match_guard(condition: str):
+	"""
+	Matches a condition with the first applicable guard rule. Like find_enum_rule, it doesn't count the hit,
+	because the caller may prefer another heuristic.
+	:return: (rule name, match), or (None, None) if no rule applies
+	"""
+	m = _guard_patterns.match(condition)
+	if m is None:
+		return None, None
+	return m.lastgroup, m  # the outer group of the alternative, since it closes after its inner groups
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import datatractor.main.blocks_extractor as b_extractor
+import datatractor.main.packets_extractor as p_extractor
+from datatractor.utils.http_tools import robust_request
+
+
+def plan_version(game_version: str, jobs: int = 1):
+	"""
+	Computes the set of pages that the extractors need for the given game version.
+	Finding them requires a few pages (version history, protocol versions, block IDs and the API), which are
+	fetched during the planning. The others, like the protocol documentation and the blocks' pages, are not.
+	:param game_version: the game version
+	:param jobs: the number of API queries to run concurrently
+	:return: the list of the URLs, without duplicates
+	"""
+	urls = []
+	# Packets extractor
+	doc_url, protocol_number = p_extractor.find_documentation(game_version)
+	if doc_url is None:
+		print("WARNING - No protocol documentation found for version", game_version)
+	else:
+		urls.append(doc_url)
+
+	# Blocks extractor
+	major_version = ".".join(game_version.split(".")[:2])
+	release_date, next_version, next_date = b_extractor.extract_release_infos(major_version, True)
+	if release_date is None:
+		print("WARNING - No release date found for version", game_version)
+	else:
+		for table in b_extractor.find_block_tables(next_date):
+			rows = b_extractor.find_block_rows(table)
+			urls.extend(url for url in b_extractor.find_block_urls(rows, next_date, jobs).values() if url)
+	return list(dict.fromkeys(urls))
+
+
+def prefetch(game_versions: list, jobs: int = 1):
+	"""
+	Fetches all the pages that the extractors need for the given game versions, so that they're in the cache.
+	:param game_versions: the game versions
+	:param jobs: the number of pages to fetch concurrently
+	:return: the number of pages that couldn't be fetched
+	"""
+	urls = []
+	for game_version in game_versions:
+		print("Planning the pages of version", game_version, "...")
+		urls.extend(plan_version(game_version, jobs))
+	urls = list(dict.fromkeys(urls))
+
+	def fetch(url):
+		try:
+			response = robust_request(url)
+			if response.status_code != 200:
+				print("WARNING - Got HTTP status %d for %s" % (response.status_code, url))
+				return False
+		except Exception as e:
+			print("WARNING - Unable to fetch %s: %s" % (url, e))
+			return False
+		return True
+
+	print("Fetching %d pages with %d jobs..." % (len(urls), jobs))
+	with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+		failures = sum(1 for ok in executor.map(fetch, urls) if not ok)
+	print("Prefetch complete: %d pages fetched, %d failures" % (len(urls) - failures, failures))
+	return failures
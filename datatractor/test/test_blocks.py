@@ -1,7 +1,7 @@
 from datatractor.main.blocks_extractor import *
 from datatractor.utils.gamepedia_wiki_tools import *
 
-requests_cache.install_cache("out/http_cache", "sqlite", 3000)
+install_cache("out/http_cache", 3000)
 
 version = "1.12"
 release_date, next_version, next_date = extract_release_infos(version, True)
@@ -0,0 +1,71 @@
+import os
+import pickle
+import time
+import tracemalloc
+
+from datatractor.utils.html_tools import *
+
+
+def protocol_page(packets: int = 300):
+	"""A page like wiki.vg's Protocol page: one table per packet, whose first cells span all the rows."""
+	html = ["<html><body><h1 id=\"firstHeading\">Protocol</h1><div id=\"mw-content-text\">"]
+	for n in range(packets):
+		fields = 3 + n % 8
+		html.append(f"<h4><span class=\"mw-headline\" id=\"Packet_{n}\">Packet {n}</span></h4><table class=\"wikitable\">")
+		html.append("<tr><th>Packet ID</th><th>State</th><th>Bound To</th><th colspan=\"2\">Field Name</th>"
+					"<th>Field Type</th><th>Notes</th></tr>")
+		for f in range(fields):
+			row = []
+			if f == 0:
+				row.append(f"<td rowspan=\"{fields}\">0x{n:02X}</td><td rowspan=\"{fields}\">Play</td>"
+						   f"<td rowspan=\"{fields}\">Client</td>")
+			if f == 1:
+				row.append(f"<td rowspan=\"2\">Array</td><td>Entry {f}</td>")
+			elif f == 2:
+				row.append(f"<td>Entry {f}</td>")
+			else:
+				row.append(f"<td colspan=\"2\">Field {f}</td>")
+			row.append(f"<td><a href=\"#VarInt\">VarInt</a></td><td>Notes of field {f}</td>")
+			html.append("<tr>" + "".join(row) + "</tr>")
+		html.append("</table>")
+	html.append("</div></body></html>")
+	return "".join(html)
+
+
+# Usage: PROTOCOL_PAGE=saved_protocol_page.html python -m datatractor.test.test_cells
+# The page isn't taken from the arguments, which belong to the test runner
+if os.environ.get("PROTOCOL_PAGE"):
+	with open(os.environ["PROTOCOL_PAGE"], encoding="utf-8") as f:
+		page = f.read()
+else:
+	page = protocol_page()
+
+for parser in backends:
+	document = parse_html(page, parser, wiki_content)
+	tracemalloc.start()
+	sections = make_hierarchy(document, detached=True)
+	size, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	tables = list(sections[0].recursive_findall(lambda e: isinstance(e, HtmlTable)))
+	cells = [c for t in tables for c in t.itr_cells() if c is not None]
+	distinct = {id(c): c for c in cells}.values()
+	print("%s: %d tables, %d cells, %d cell objects, %.1f KiB (peak %.1f KiB)" % (
+		parser, len(tables), len(cells), len(distinct), size / 1024, peak / 1024))
+	# One RefCell per BigCell, and no __dict__
+	big_cells = [c for c in distinct if isinstance(c, BigCell)]
+	ref_cells = [c for c in distinct if isinstance(c, RefCell)]
+	assert len(ref_cells) == len(big_cells) and {id(r.ref) for r in ref_cells} == {id(b) for b in big_cells}
+	assert not any(hasattr(c, "__dict__") for c in cells) and not hasattr(tables[0], "__dict__")
+	ref = next(r for r in ref_cells if r.ref.row_count() > 1)
+	assert ref.row_count() == ref.column_count() == 1 and not ref.is_vertical() and ref.is_up_ref()
+
+	# The texts and links are computed once per cell
+	durations = []
+	for _ in range(3):
+		start = time.perf_counter()
+		texts = [(get_text(c), get_link(c)) for c in cells]
+		durations.append(time.perf_counter() - start)
+	print("texts and links of the cells: %.1fms, then %.1fms" % (durations[0] * 1000, durations[-1] * 1000))
+	assert all(c.ref._extracted if isinstance(c, RefCell) else c._extracted for c in cells)
+	assert [(get_text(c), get_link(c)) for c in pickle.loads(pickle.dumps(cells))] == texts
+print("OK")
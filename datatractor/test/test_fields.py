@@ -0,0 +1,59 @@
+import random
+import time
+
+from datatractor.main.packets_data import *
+
+# The matcher finds the overlapping keywords, and forgets the removed ones
+matcher = KeywordMatcher()
+for keyword in ["he", "she", "his", "hers", "entity", "entityid", "id"]:
+	matcher.add(keyword, keyword.upper())
+assert matcher.find("ushers") == {"he", "she", "hers"}
+assert matcher.find("the entityid") == {"he", "entity", "entityid", "id"}
+matcher.remove("entity", "ENTITY")
+assert matcher.find("the entityid") == {"he", "entityid", "id"}
+matcher.add("tit", "TIT")  # added after a search
+assert matcher.find("the entityid") == {"he", "entityid", "id", "tit"}
+matcher.add("entity", "ENTITY2")
+assert matcher.find("entity") == {"entity", "tit"} and matcher.values["entity"] == ["ENTITY2"]
+
+
+def old_find(p: PacketInfos, last: str, row0: List[str], accept):
+	"""The scan that find_mentioned_field replaces, to check that they find the same fields."""
+	fields = sorted(p.all_fields, key=lambda f: len(f.name), reverse=True)
+	for field in fields:
+		if accept(field) and (field.name.lower() in last or field.name.lower() in row0):
+			return field
+	return None
+
+
+# The indexed lookup gives the same field as the scan of all the fields, including after renames
+rng = random.Random(7)
+words = ["entity", "id", "action", "count", "length", "type", "slot", "data", "item", "player", "mode", "x", "flags"]
+for n in range(300):
+	p = PacketInfos.without_section("Packet", 0)
+	for f in range(rng.randint(1, 40)):
+		name = "".join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+		p.register_field(Field(rng.choice([name, name.title()]), rng.choice(["Varint", "Boolean", "String"]), None))
+	for field in rng.sample(p.all_fields, min(3, len(p.all_fields))):
+		p.rename_field(field, field.name + "Length")
+	for t in range(20):
+		last = " ".join(rng.choice(words + ["the", "of"]) for _ in range(rng.randint(0, 12)))
+		row0 = [rng.choice(words) for _ in range(rng.randint(0, 3))]
+		accept = rng.choice([lambda f: True, lambda f: f.type != "Boolean", lambda f: "a" in f.name])
+		assert p.find_mentioned_field(last, row0, accept) is old_find(p, last, row0, accept), (last, row0)
+
+# With many fields, the lookup doesn't depend on their number
+p = PacketInfos.without_section("Packet", 0)
+for f in range(400):
+	p.register_field(Field(f"{rng.choice(words)}{f}", "Varint", None))
+texts = [" ".join(rng.choice(words) for _ in range(30)) + " entity399" for _ in range(200)]
+start = time.perf_counter()
+old = [old_find(p, text, [], lambda f: True) for text in texts]
+old_time = time.perf_counter() - start
+start = time.perf_counter()
+new = [p.find_mentioned_field(text, [], lambda f: True) for text in texts]
+new_time = time.perf_counter() - start
+assert old == new
+print("related field of %d tables among %d fields, scan: %.1fms, index: %.1fms" % (
+	len(texts), len(p.all_fields), old_time * 1000, new_time * 1000))
+print("OK")
@@ -0,0 +1,52 @@
+import gc
+import time
+
+from datatractor.utils.html_tools import *
+
+
+def nested_page(depth: int):
+	"""A page whose content is wrapped in depth nested <div>, with a heading every 10 levels and a table at the bottom."""
+	html = ["<html><body><h1>Root</h1>"]
+	for i in range(depth):
+		html.append(f"<div><p>Text {i}</p>")
+		if i % 10 == 0:
+			html.append(f"<h2 id=\"h{i}\">Heading {i}</h2>")
+	html.append("<table><tr><td>Cell</td></tr></table>")
+	html.append("</div>" * depth)
+	html.append("</body></html>")
+	return "".join(html)
+
+
+# The wrappers are flattened, the other tags are kept
+for parser in backends:
+	root = make_hierarchy(parse_html(nested_page(25), parser))[0]
+	assert [s.html_id for s in root.subs()] == ["h0", "h10", "h20"]
+	last = root.sub_id("h20")
+	assert [get_text(e) for e in last.content[:-1]] == ["Text %d" % i for i in range(21, 25)]
+	assert isinstance(last.content[-1], HtmlTable)
+
+# Benchmark: the time per level must not grow with the depth (the former version was quadratic)
+print("depth   " + "".join(p.rjust(10) for p in backends))
+times = {}
+gc.disable()  # the collections of the young objects add noise
+for depth in [250, 500, 1000, 2000]:
+	page = nested_page(depth)
+	row = []
+	for parser in backends:
+		document = parse_html(page, parser)
+		durations = []
+		for _ in range(3):
+			start = time.perf_counter()
+			sections = make_hierarchy(document)
+			durations.append(time.perf_counter() - start)
+			# Not timed: lxml frees the proxy of an element by walking up to the nearest ancestor that still has one,
+			# which is the document here, so freeing the sections of a deep tree is quadratic whatever builds them
+			del sections
+		times[parser, depth] = min(durations)
+		row.append("%9.1fms" % (times[parser, depth] * 1000))
+	print(str(depth).ljust(8) + "".join(row))
+gc.enable()
+for parser in backends:
+	growth = (times[parser, 2000] / 2000) / (times[parser, 250] / 250)
+	assert growth < 3, f"{parser}: the time per level is {growth:.1f} times longer at 8 times the depth"  # 8 if quadratic
+print("OK")
@@ -1,6 +1,6 @@
 from datatractor.utils.gamepedia_wiki_tools import *
 
-requests_cache.install_cache("out/http_cache", "sqlite", 300)
+install_cache("out/http_cache", 300)
 
 version = "1.11"
 release_date, next_version, next_date = extract_release_infos(version, True)
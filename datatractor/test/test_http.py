@@ -0,0 +1,229 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from datatractor.utils import html_tools, http_tools, page_store
+from datatractor.utils.page_store import PageStore
+
+# Local server: /same/* all return the same body, /page/<n> returns n bytes, /flaky/* fail twice,
+# /empty is always empty, /stall never answers in time, /slow_once/* are slow on their first request
+# and /redirect/<path> redirect to /<path>
+hits = []
+failures = {}
+in_flight = [0, 0]  # current, maximum
+in_flight_lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		hits.append(self.path)
+		if self.path.startswith("/flaky/") and failures.get(self.path, 0) < 2:
+			failures[self.path] = failures.get(self.path, 0) + 1
+			self.send_response(503 if failures[self.path] == 1 else 429)
+			self.send_header("Retry-After", "0")
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+		if self.path.startswith("/redirect/"):
+			self.send_response(301)
+			self.send_header("Location", self.path[len("/redirect"):])
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+		if self.path == "/stall":
+			time.sleep(1)
+		if self.path.startswith("/limited/"):
+			with in_flight_lock:
+				in_flight[0] += 1
+				in_flight[1] = max(in_flight)
+			time.sleep(0.05)
+			with in_flight_lock:
+				in_flight[0] -= 1
+		if self.path.startswith("/slow_once/") and self.path not in failures:
+			failures[self.path] = 1
+			time.sleep(1)
+		if self.path == "/empty":
+			body = b""
+		elif self.path.startswith("/page/"):
+			body = b"x" * int(self.path[6:].split("?")[0])
+		elif self.path.startswith("/same/"):
+			body = b"same body"
+		else:
+			body = ("page " + self.path).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/html; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+server.handle_error = lambda request, address: None  # the client closes the timed out and hedged requests
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base = "http://127.0.0.1:%d" % server.server_port
+cache_dir = tempfile.mkdtemp()
+
+# Page store + cache policy -----------------------------
+http_tools.install_cache(cache_dir, 1)
+fixed = base + "/index.php?title=A&oldid=5"
+latest = base + "/Latest"
+for url in [fixed, latest, fixed, latest]:
+	assert http_tools.robust_request(url).text == "page " + url[len(base):]
+assert hits == ["/index.php?title=A&oldid=5", "/Latest"], hits
+time.sleep(1.2)
+http_tools.robust_request(fixed)
+http_tools.robust_request(latest)
+assert hits[2:] == ["/Latest"], hits  # only the latest revision has expired
+
+# Redirections are cached with their Location
+for i in range(2):
+	redirected = http_tools.robust_request(base + "/redirect/index.php?title=B&oldid=6")
+	assert redirected.text == "page /index.php?title=B&oldid=6" and redirected.history[0].status_code == 301
+assert hits[3:] == ["/redirect/index.php?title=B&oldid=6", "/index.php?title=B&oldid=6"], hits
+
+# The pages are parsed by the selected backend
+assert http_tools.robust_soup(latest).find("body").text == "page /Latest"
+html_tools.backend = "lxml"
+try:
+	assert http_tools.robust_soup(latest).find("body").text == "page /Latest"  # an lxml element
+	assert http_tools.robust_soup(latest, parser="bs4").find("body") is not None
+	assert not hasattr(http_tools.robust_soup(latest), "find_all")
+finally:
+	html_tools.backend = "bs4"
+
+# Identical bodies are stored once
+http_tools.robust_request(base + "/same/1")
+http_tools.robust_request(base + "/same/2")
+store = http_tools.page_store
+assert store.urls[base + "/same/1"]["hash"] == store.urls[base + "/same/2"]["hash"]
+assert len(store.blobs) == 5  # with the empty body of the redirection
+
+# The index survives a restart
+store.close()
+reopened = PageStore(cache_dir)
+assert reopened.get(fixed)[1] == b"page /index.php?title=A&oldid=5"
+
+# LRU eviction
+small = PageStore(tempfile.mkdtemp(), max_size=70)  # room for two compressed bodies
+small.put("a", b"a" * 1000)
+small.put("b", b"b" * 1000)
+small.get("a")
+small.put("c", b"c" * 1000)  # evicts b, the least recently used
+assert small.get("b") is None and small.get("a") is not None and small.get("c") is not None
+assert small.size() <= 70
+# A blob deleted between the lookup and the read, by a concurrent eviction, is a miss
+def evicting_open(path, *args):
+	small._remove_url("a")
+	return open(path, *args)
+
+
+page_store.open = evicting_open
+try:
+	assert small.get("a") is None
+finally:
+	del page_store.open
+shutil.rmtree(small.directory)
+
+# The index is written periodically and on close, not on every put
+many = PageStore(tempfile.mkdtemp())
+for i in range(500):
+	many.put("url%d" % i, b"body %d" % (i % 10))
+assert not os.path.exists(os.path.join(many.directory, PageStore.index_name))
+assert len(many.blobs) == 10 and many.refs[next(iter(many.blobs))] == 50
+for i in range(50):
+	many.put("url%d" % (i * 10), b"other")
+assert len(many.blobs) == 10 and many.refs == {h: 50 for h in many.blobs}  # the body of url0, url10... is gone
+many.close()
+assert len(PageStore(many.directory).urls) == 500
+shutil.rmtree(many.directory)
+
+# Retry policy -----------------------------------------
+policy = http_tools.RetryPolicy(read_timeout=0.2, max_retries=3, backoff_base=0.01, deadline=0.5)
+assert http_tools.robust_request(base + "/flaky/1", policy).text == "page /flaky/1"
+assert hits.count("/flaky/1") == 3
+response = http_tools.robust_request(base + "/empty", policy)
+assert response.status_code == 200 and response.text == ""
+assert hits.count("/empty") == 4  # first attempt + 3 retries
+start = time.monotonic()
+try:
+	http_tools.robust_request(base + "/stall", policy)
+	assert False, "the stalled request should time out"
+except requests.Timeout:
+	pass
+assert time.monotonic() - start < 0.8  # bounded by the deadline
+assert policy.delay(1) <= 0.01 and policy.delay(3) <= 0.04
+
+# Hedged requests --------------------------------------
+http_tools.enable_hedging(percentile=0.9, budget=0.5, min_samples=5)
+for i in range(5):
+	http_tools.robust_request(base + "/fast/%d" % i)
+start = time.monotonic()
+assert http_tools.robust_request(base + "/slow_once/1").text == "page /slow_once/1"
+assert time.monotonic() - start < 0.5  # the duplicate answered first
+assert hits.count("/slow_once/1") == 2
+host = "127.0.0.1:%d" % server.server_port
+assert http_tools.hedger.hedges[host] == 1
+http_tools.hedger.budget = 0.0
+start = time.monotonic()
+http_tools.robust_request(base + "/slow_once/2")
+assert time.monotonic() - start >= 1.0  # no budget left
+assert hits.count("/slow_once/2") == 1
+http_tools.hedger = None
+
+# Rate limiter and concurrency governor -----------------
+http_tools.limit_hosts(rate=20, burst=2, max_in_flight=2)
+start = time.monotonic()
+with ThreadPoolExecutor(max_workers=6) as executor:
+	list(executor.map(lambda i: http_tools.robust_request(base + "/limited/%d" % i), range(8)))
+assert in_flight[1] == 2
+assert time.monotonic() - start >= 0.25  # 2 requests at once, then 20 per second
+assert http_tools.limiter.waits > 0 and http_tools.limiter.wait_time > 0
+cached_start = time.monotonic()
+http_tools.robust_request(base + "/limited/0")  # the cache isn't limited
+assert time.monotonic() - cached_start < 0.05
+
+# Record and replay -------------------------------------
+archive_path = os.path.join(cache_dir, "archive.zip")
+http_tools.record(archive_path)
+atexit.unregister(http_tools.archive.save)
+http_tools.robust_request(fixed)  # from the cache, recorded anyway
+http_tools.robust_request(base + "/recorded")
+assert http_tools.robust_request(base + "/redirect/target").text == "page /target"
+http_tools.archive.save()
+hit_count = len(hits)
+try:
+	http_tools.replay(archive_path)
+	assert http_tools.robust_request(fixed).text == "page /index.php?title=A&oldid=5"
+	assert http_tools.robust_request(base + "/recorded").text == "page /recorded"
+	redirected = http_tools.robust_request(base + "/redirect/target")
+	assert redirected.text == "page /target" and redirected.url == base + "/target"
+	assert redirected.history[0].status_code == 301
+	try:
+		http_tools.robust_request(base + "/not_recorded")
+		assert False, "the replay mode shouldn't access the network"
+	except requests.ConnectionError:
+		pass
+	assert len(hits) == hit_count
+finally:
+	# Back to the default session, for the tests that run after this one in the same process
+	http_tools.archive = None
+	http_tools.replay_mode = False
+	atexit.unregister(http_tools.page_store.close)
+	http_tools.page_store = None
+	http_tools.cache_policy = None
+	http_tools.limiter = None
+	http_tools.configure_session()
+	shutil.rmtree(cache_dir)
+print("OK")
@@ -0,0 +1,74 @@
+import io
+import json
+import time
+from http import HTTPStatus
+
+from datatractor.main.json_exporter import *
+
+
+def make_packet(n: int):
+	"""A packet with an enum, a switch, an array of compounds with its length and an optional field."""
+	p = PacketInfos.without_section(f"Packet{n}", n)
+	action = Field("action", "Varint", 'The "action", 0: add\nor 1: remove')
+	Enum(action).add_entry(EnumEntry("0", "ADD", 'Adds a "player"'))
+	action.enum.add_entry(EnumEntry("1", "REMOVE"))
+	count = Field("playersLength", "Varint", None)
+	players = Field("players", "Array[Player]", None)
+	players.set_length_given_by(count)
+	player = Compound("Player", players)
+	uuid = Field("uuid", "Uuid", "The player's \\ UUID")
+	player.add_field(uuid)
+	switch = Switch(action, True)
+	add = SwitchEntry("0", "Add")
+	add.add_field(Field("name", "String", None, 16))
+	switch.add_entry(add)
+	switch.add_entry(SwitchEntry("1", "Remove"))
+	player.add_switch(switch)
+	flag = Field("hasTarget", "Boolean", None)
+	target = Field("target", "Option[Varint]", "Only if has target is true")
+	target.only_if = flag.name
+	for field in [action, count, players, flag, target]:
+		p.main_compound.add_field(field)
+		p.register_field(field)
+	return p
+
+
+# The JSON is valid, with the references as names
+packet = make_packet(3)
+data = json.loads(packet.json())
+assert data["dataType"] == "PacketInfos" and data["id"] == 3
+action, count, players, flag, target = data["compound"]["entries"]
+assert action["comment"] == 'The "action", 0: add\nor 1: remove' and action["switch"] == "Action"
+assert action["enum"]["field"] == "action" and action["enum"]["entries"][0]["comment"] == 'Adds a "player"'
+assert action["enum"]["entries"][1] == {"dataType": "EnumEntry", "name": "REMOVE", "value": "1", "comment": None}
+assert players["lengthGivenBy"] == "playersLength" and players["compound"]["field"] == "players"
+uuid, switch = players["compound"]["entries"]
+assert uuid["comment"] == "The player's \\ UUID"
+assert switch["field"] == "action" and switch["isRefOut"] is True
+assert switch["entries"][0]["entries"][0]["stringMaxLength"] == 16
+assert target["onlyIf"] == "hasTarget" and flag["enum"] is None
+
+# The numbers are written as JSON numbers, and the non-finite floats, which JSON can't represent, are rejected
+assert json.loads(to_json([0, -3, 2.5, 1e100, True, None])) == [0, -3, 2.5, 1e100, True, None]
+assert to_json([HTTPStatus.OK]) == "[200]"  # an int subclass
+for number in [float("nan"), float("inf"), float("-inf")]:
+	try:
+		to_json(EnumEntry(number, "VALUE"))
+		assert False, number
+	except ValueError:
+		pass
+
+# A whole protocol is written piece by piece
+subs = [SubProtocol(name, [make_packet(i) for i in range(200)], [make_packet(i) for i in range(200)])
+		for name in ["Handshaking", "Play", "Status", "Login"]]
+protocol = Protocol("http://wiki.vg/index.php?title=Protocol&oldid=14204", "1.12.2", 340, *subs)
+out = io.StringIO()
+start = time.perf_counter()
+write_json(protocol, out)
+elapsed = time.perf_counter() - start
+data = json.loads(out.getvalue())
+assert data["gameVersion"] == "1.12.2" and data["number"] == 340 and data["handshake"]["name"] == "Handshaking"
+assert len(data["play"]["clientBound"]) == len(data["login"]["serverBound"]) == 200
+assert out.getvalue() == protocol.json()
+print("%d packets exported in %.1fms, %d KiB" % (1600, elapsed * 1000, len(out.getvalue()) // 1024))
+print("OK")
@@ -0,0 +1,212 @@
+import pickle
+import tempfile
+import time
+
+from datatractor.utils import html_tools
+from datatractor.utils.html_tools import *
+
+# A page with the structures of wiki.vg and gamepedia: nested divs, headings with spans, tables with spans,
+# struck-through rows, rows wider than the first one, lists, links, comments and entities
+page = """<!DOCTYPE html>
+<html><head><title>Test</title></head>
+<body>
+<div id="content"><h1 id="firstHeading">Protocol</h1>
+<div id="bodyContent"><div id="mw-content-text">
+<p>Intro with a <a href="/Link">link</a> &amp; an entity&nbsp;here.</p>
+<!-- a comment -->
+<h2><span class="mw-headline" id="Handshaking">Handshaking</span></h2>
+<h3><span class="mw-headline" id="Serverbound">Serverbound</span></h3>
+<h4><span class="mw-headline" id="Handshake">Handshake</span></h4>
+<table class="wikitable">
+<tr><th>Packet ID</th><th>State</th><th>Bound To</th><th>Field Name</th><th>Field Type</th><th>Notes</th></tr>
+<tr><td rowspan="4">0x00</td><td rowspan="4">Handshaking</td><td rowspan="4">Server</td>
+<td>Protocol Version</td><td><a href="#VarInt">VarInt</a></td><td>See <a href="/Protocol_version_numbers">protocol version numbers</a></td></tr>
+<tr><td>Server Address</td><td>String (255)</td><td>Hostname or IP, e.g. localhost</td></tr>
+<tr style="text-decoration: line-through"><td style="text-decoration: line-through">Old</td><td style="text-decoration: line-through">Byte</td><td style="text-decoration: line-through">Removed</td></tr>
+<tr><td>Next State</td><td>VarInt Enum</td><td>1 for <del>ping</del> status, 2 for login<br/>second line</td></tr>
+<tr><td colspan="3">Wide</td><td></td><td>  </td><td><b></b></td><td>Extra</td></tr>
+</table>
+<div><div><p>Nested <i>text</i></p>
+<ul><li>One</li><li><a href="/Two">Two</a></li><li><ol><li>Inner</li></ol></li><li><table><tr><td>T</td></tr></table></li></ul>
+</div></div>
+<pre>  <span>  </span>  code</pre>
+<h2 id="Direct">Direct <span>id</span></h2>
+Loose text
+<div class="wrap"><table class="infobox-rows"><tr><th>Hardness</th><td>1.5</td></tr></table>
+<table><tr><td><table><tr><td>nested</td></tr></table></td></tr></table></div>
+<h3><span id="Empty"></span></h3>
+</div></div></div>
+<div id="mw-navigation"><h2>Navigation menu</h2><ul><li><a href="/Main_Page">Main page</a></li></ul></div>
+<div id="footer"><table><tr><td>Footer</td></tr></table></div>
+</body></html>
+"""
+
+
+def dump(element):
+	"""Converts an element of the hierarchy to a comparable structure, whatever the backend."""
+	if isinstance(element, HtmlSection):
+		return "section", element.level, element.html_id, str(element.title), [dump(e) for e in element.content]
+	elif isinstance(element, HtmlTable):
+		return "table", [[dump_cell(c) for c in row] for row in element.rows]
+	elif isinstance(element, HtmlList):
+		return "list", element.is_ordered, [dump(e) for e in element.elements]
+	return "element", tag_name(element), get_text(element), get_link(element)
+
+
+def dump_cell(cell):
+	if cell is None:
+		return None
+	return (type(cell).__name__, cell.is_header, cell.is_deleted, cell.row_count(), cell.column_count(),
+			get_text(cell), get_link(cell))
+
+
+for trim in [True, False]:
+	for content in [None, wiki_content, ["missing"]]:
+		bs4_tree = [dump(s) for s in make_hierarchy(parse_html(page, "bs4", content), trim)]
+		lxml_tree = [dump(s) for s in make_hierarchy(parse_html(page, "lxml", content), trim)]
+		assert bs4_tree == lxml_tree, f"{bs4_tree}\n!=\n{lxml_tree}"
+
+# The content selector drops the navigation and the footer, and keeps everything else
+for parser in backends:
+	whole = make_hierarchy(parse_html(page, parser))
+	content = make_hierarchy(parse_html(page, parser, wiki_content))
+	assert "Navigation menu" in [s.title for s in whole[0].subs()] and "Footer" in str(dump(whole[0]))
+	assert "Navigation menu" not in [s.title for s in content[0].subs()] and "Footer" not in str(dump(content[0]))
+	assert dump(content[0].sub_id("Handshaking")) == dump(whole[0].sub_id("Handshaking"))
+	assert dump(make_hierarchy(parse_html(page, parser, ["missing"]))[0]) == dump(whole[0])  # falls back to the page
+
+root = make_hierarchy(parse_html(page, "lxml"))[0]
+assert root.title == "Protocol" and root.html_id == "firstHeading"
+handshake = root.recursive_find(lambda e: isinstance(e, HtmlSection) and e.html_id == "Handshake")
+table = handshake.find(lambda e: isinstance(e, HtmlTable))
+assert get_text(table.get(1, 3)) == "Protocol Version" and get_link(table.get(1, 4)) == "#VarInt"
+assert table.row_count() == 5 and table.column_count() == 7  # the struck-through row is skipped
+assert [get_text(c) for c in table.rows[3][:3]] == ["0x00", "Handshaking", "Server"]  # rowspan across the deleted row
+assert table.get(0, 6) is None and get_text(table.get(4, 6)) == "Extra"
+assert get_text(table.get(3, 5)) == "1 for status, 2 for login  second line"
+assert next(find_tags(parse_html(page, "lxml"), "table", "infobox-rows")).get("class") == "infobox-rows"
+
+# The empty rows, like spacers, are kept
+spaced = "<table><tr><th>A</th><th>B</th></tr><tr></tr><tr><td>1</td><td>2</td></tr><tr></tr></table>"
+for parser in backends:
+	table = next(find_tags(parse_html(spaced, parser), "table"))
+	table = parse_table(table, True)
+	assert table.row_count() == 4 and table.rows[1] == [None, None] and table.rows[3] == [None, None]
+	assert get_text(table.get(2, 1)) == "2"
+
+# The indexed lookups give the same results as the scans
+for parser in backends:
+	root = make_hierarchy(parse_html(page, parser))[0]
+	sections = [root]
+	for section in sections:
+		sections.extend(section.subs())
+	for section in sections:
+		for t in [HtmlTable, HtmlList, HtmlSection]:
+			assert list(section.recursive_findall_type(t)) == list(section.recursive_findall(lambda e: isinstance(e, t)))
+			assert section.find_type_i(t) == section.find_i(lambda e: isinstance(e, t))
+		for other in sections[1:]:  # the None ids and titles aren't indexed
+			if other.html_id is not None:
+				assert section.recursive_sub_id(other.html_id) is section.recursive_find(
+					lambda e: isinstance(e, HtmlSection) and e.html_id == other.html_id)
+			if other.title is not None:
+				assert section.sub_title(other.title) is section.find(
+					lambda e: isinstance(e, HtmlSection) and e.title == other.title)
+	assert root.recursive_sub_id("Handshake").title == "Handshake" and root.sub_id("Handshake") is None
+
+big_page = page.replace("<body>", "<body>" + page[page.index("<div id=\"content\">"):page.index("</body>")] * 50)
+
+# The lazy sections are parsed on the first access to their content, and are identical to the eager ones
+for parser in backends:
+	for trim in [True, False]:
+		lazy = make_hierarchy(parse_html(page, parser), trim)
+		eager = make_hierarchy(parse_html(page, parser), trim, lazy=False)
+		assert [dump(s) for s in lazy] == [dump(s) for s in eager]
+	lazy = make_hierarchy(parse_html(page, parser))
+	handshake = lazy[0].recursive_sub_id("Handshake")
+	assert not lazy[0].is_parsed() and not handshake.is_parsed()
+	assert isinstance(handshake.find_type(HtmlTable), HtmlTable) and handshake.is_parsed()
+	assert not lazy[0].is_parsed() and not lazy[0].sub_id("Direct").is_parsed()
+	start = time.perf_counter()
+	make_hierarchy(parse_html(big_page, parser), lazy=False)[0].recursive_sub_id("Handshake").find_type(HtmlTable)
+	eager_time = time.perf_counter() - start
+	start = time.perf_counter()
+	make_hierarchy(parse_html(big_page, parser))[0].recursive_sub_id("Handshake").find_type(HtmlTable)
+	lazy_time = time.perf_counter() - start
+	print("%s: one section of the big page, eager: %.3fs, lazy: %.3fs" % (parser, eager_time, lazy_time))
+
+# The detached sections have the same content, without any reference to the document
+for parser in backends:
+	for trim in [True, False]:
+		attached = make_hierarchy(parse_html(page, parser), trim)
+		detached = make_hierarchy(parse_html(page, parser), trim, detached=True)
+		assert [dump(s) for s in attached] == [dump(s) for s in detached]
+		data = pickle.dumps(detached)
+		assert b"bs4" not in data and b"lxml" not in data
+		assert [dump(s) for s in pickle.loads(data)] == [dump(s) for s in attached]
+	detached = make_hierarchy(parse_html(page, parser), detached=True)
+	handshake = detached[0].recursive_find(lambda e: isinstance(e, HtmlSection) and e.html_id == "Handshake")
+	notes = handshake.find(lambda e: isinstance(e, HtmlTable)).get(1, 5)
+	assert isinstance(notes.content, InlineContent)
+	assert notes.content.markup == [(None, "See", None), ("a", "protocol version numbers", "/Protocol_version_numbers")]
+	assert type(detached[0].title) is str
+	# Only the kept sections of a lazy hierarchy are parsed and detached, with the sections that lead to them
+	lazy = make_hierarchy(parse_html(page, parser))
+	kept = detach_section(lazy[0], ["Handshaking"])
+	assert [s.html_id for s in kept.subs()] == ["Handshaking"] and kept.content == [kept.sub_id("Handshaking")]
+	assert dump(kept.sub_id("Handshaking")) == dump(detached[0].sub_id("Handshaking"))
+	assert not lazy[0].sub_id("Direct").is_parsed()
+	assert detach_section(lazy[0], ["Unknown"]) is None
+	assert dump(detach_section(lazy[0])) == dump(detached[0])
+	data = pickle.dumps(kept)
+	assert b"bs4" not in data and b"lxml" not in data
+
+# The cached hierarchies are loaded instead of parsing the page again, until the parser's version changes
+parses = []
+real_parse_html = html_tools.parse_html
+
+
+def counted_parse_html(*args, **kwargs):
+	parses.append(args)
+	return real_parse_html(*args, **kwargs)
+
+
+html_tools.parse_html = counted_parse_html
+with tempfile.TemporaryDirectory() as cache_dir:
+	html_tools.install_tree_cache(cache_dir)
+	expected = [dump(s) for s in make_hierarchy(real_parse_html(page, content=wiki_content), detached=True)]
+	assert [dump(s) for s in cached_hierarchy(page, wiki_content)] == expected
+	assert [dump(s) for s in cached_hierarchy(page, wiki_content)] == expected
+	assert len(parses) == 1
+	cached_hierarchy(page)
+	assert len(parses) == 2
+	assert [s.html_id for s in cached_hierarchy(page, wiki_content, ids=["Direct"])[0].subs()] == ["Direct"]
+	assert len(parses) == 3  # the cached hierarchy of the whole page isn't reused
+	parses.pop()
+	html_tools.PARSER_VERSION += 1
+	assert [dump(s) for s in cached_hierarchy(page, wiki_content)] == expected
+	assert len(parses) == 3
+	html_tools.backend = "lxml"  # the trees of the other backend aren't reused
+	cached_hierarchy(page, wiki_content)
+	assert len(parses) == 4
+	html_tools.backend = "bs4"
+	start = time.perf_counter()
+	cached_hierarchy(big_page, wiki_content)
+	cold_time = time.perf_counter() - start
+	start = time.perf_counter()
+	cached_hierarchy(big_page, wiki_content)
+	warm_time = time.perf_counter() - start
+	print("cached hierarchy of the big page, cold: %.3fs, warm: %.3fs" % (cold_time, warm_time))
+	html_tools.PARSER_VERSION -= 1
+	html_tools.tree_cache = None
+html_tools.parse_html = real_parse_html
+
+# The lxml backend avoids the BeautifulSoup tree
+times = {}
+for parser in backends:
+	for content in [None, wiki_content]:
+		start = time.perf_counter()
+		make_hierarchy(parse_html(big_page, parser, content), lazy=False)
+		times[parser, content is not None] = time.perf_counter() - start
+	print("%s: %.3fs, content only: %.3fs" % (parser, times[parser, False], times[parser, True]))
+print("lxml speedup: %.1fx" % (times["bs4", False] / times["lxml", False]))
+print("OK")
@@ -0,0 +1,96 @@
+import gzip
+import tempfile
+import time
+
+from datatractor.main import packets_extractor
+from datatractor.utils import html_tools
+
+from datatractor.main.packets_extractor import *
+
+
+def protocol_page(packets: int = 120):
+	"""A page like the Play section of wiki.vg's Protocol page, with clientbound and serverbound packets."""
+	html = ["<html><body><h1 id=\"firstHeading\">Protocol</h1><div id=\"mw-content-text\">",
+			"<h2><span class=\"mw-headline\" id=\"Play\">Play</span></h2>"]
+	for bound, to in [("Clientbound", "Client"), ("Serverbound", "Server")]:
+		html.append(f"<h3><span class=\"mw-headline\" id=\"{bound}\">{bound}</span></h3>")
+		for n in range(packets // 2):
+			fields = 2 + n % 6
+			html.append(f"<h4><span class=\"mw-headline\" id=\"{bound}_{n}\">{bound} Packet {n}</span></h4>"
+						"<p>A packet.</p><table class=\"wikitable\"><tr><th>Packet ID</th><th>State</th>"
+						"<th>Bound To</th><th>Field Name</th><th>Field Type</th><th>Notes</th></tr>")
+			for f in range(fields):
+				row = ""
+				if f == 0:
+					row = f"<td rowspan=\"{fields}\">0x{n:02X}</td><td rowspan=\"{fields}\">Play</td>" \
+						  f"<td rowspan=\"{fields}\">{to}</td>"
+				if f == 1:
+					row += "<td>Mode</td><td>VarInt Enum</td><td>0: first, 1: second, 2: third</td>"
+				else:
+					row += f"<td>Field {f}</td><td>VarInt</td><td>Notes of field {f}</td>"
+				html.append(f"<tr>{row}</tr>")
+			html.append("</table>")
+	html.append("</div></body></html>")
+	return "".join(html)
+
+
+def dump(sub: SubProtocol):
+	l = []
+	for p in sub.clientbound + sub.serverbound:
+		l.append(f"{p.id()} ")
+		str_compound(l, p.main_compound)
+	return "".join(l)
+
+
+# The packets analysed by a pool of processes are the same, in the same order
+play = make_hierarchy(parse_html(protocol_page(), content=wiki_content), detached=True)[0].sub_id("Play")
+times = {}
+for processes in [1, 4]:
+	if processes > 1:
+		install_pool(processes)
+		assert pool_chunksize(40) == 0  # too few packets for 4 processes, analysed in this process
+		assert pool_chunksize(120) == 8 and pool_chunksize(1000) == 63  # 4 chunks per process
+	start = time.perf_counter()
+	sub = extract_subprotocol(play)
+	times[processes] = time.perf_counter() - start
+	assert len(sub.clientbound) == len(sub.serverbound) == 60
+	assert [p.name() for p in sub.clientbound[:2]] == ["ClientboundPacket0", "ClientboundPacket1"]
+	assert sub.serverbound[0].main_compound.entries[1].enum is not None
+	if processes == 1:
+		serial = dump(sub)
+	else:
+		assert dump(sub) == serial
+		assert sub.clientbound[0].section is None  # stripped by the worker
+packets_extractor.pool.shutdown()
+packets_extractor.pool = None
+packets_extractor.pool_size = 1
+print("serial: %.3fs, 4 processes: %.3fs" % (times[1], times[4]))
+
+# The analysed protocol is saved without its sections, and loaded for the same revision and extractor version
+protocol = Protocol("http://wiki.vg/index.php?title=Protocol&oldid=14204", "1.12.2", 340, sub, sub, sub, sub)
+with tempfile.TemporaryDirectory() as ir_dir:
+	assert ir_path("1.12.2", protocol.doc_url) is None  # disabled
+	install_ir_cache(ir_dir)
+	assert ir_path("1.12.2", "http://wiki.vg/Protocol") is None  # not a fixed revision
+	path = ir_path("1.12.2", protocol.doc_url)
+	assert load_protocol(path) is None
+	save_protocol(protocol, path)
+	with open(path, "rb") as f:
+		assert b"HtmlSection" not in gzip.decompress(f.read())
+	loaded = load_protocol(path)
+	assert loaded.number == 340 and dump(loaded.play) == serial
+	field = loaded.play.serverbound[0].main_compound.entries[1]
+	assert field.enum.field is field
+	packets_extractor.EXTRACTOR_VERSION += 1
+	assert load_protocol(ir_path("1.12.2", protocol.doc_url)) is None
+	packets_extractor.EXTRACTOR_VERSION -= 1
+	# The trees of another parser give another protocol
+	html_tools.PARSER_VERSION += 1
+	assert load_protocol(ir_path("1.12.2", protocol.doc_url)) is None
+	html_tools.PARSER_VERSION -= 1
+	html_tools.backend = "lxml"
+	assert load_protocol(ir_path("1.12.2", protocol.doc_url)) is None
+	html_tools.backend = "bs4"
+	assert load_protocol(ir_path("1.12.2", protocol.doc_url)) is not None
+	packets_extractor.ir_cache = None
+print("OK")
@@ -0,0 +1,84 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import datatractor.utils.gamepedia_wiki_tools as wiki
+from datatractor.utils.gamepedia_wiki_tools import *
+
+# Stand-in for the MediaWiki API, with a few pages and their revisions (newest first)
+revisions = {
+	"Stone": [(300, "2018-07-18T10:00:00Z"), (200, "2017-06-01T10:00:00Z"), (100, "2016-01-01T10:00:00Z")],
+	"Door": [(310, "2018-08-01T10:00:00Z"), (210, "2017-06-06T23:59:59Z")],
+	"Fence": [(220, "2017-01-01T10:00:00Z")],
+	"Glazed Terracotta": [(330, "2018-09-09T10:00:00Z")],
+}
+redirects = {"Iron Door": "Door", "Oak Fence": "Fence"}
+queries = []
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		params = {k: v[0] for (k, v) in parse_qs(urlparse(self.path).query).items()}
+		queries.append(params)
+		titles = params["titles"].split("|")
+		if len(titles) > 1 and "rvstart" in params:
+			result = {"error": {"code": "multpages"}}
+		else:
+			result = {"query": self.query(titles, params)}
+		body = json.dumps(result).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def query(self, titles, params):
+		query = {"normalized": [], "redirects": [], "pages": {}}
+		for i, title in enumerate(titles):
+			normalized = title.replace("_", " ")
+			if normalized != title:
+				query["normalized"].append({"from": title, "to": normalized})
+			final = redirects.get(normalized, normalized)
+			if final != normalized:
+				query["redirects"].append({"from": normalized, "to": final})
+			page = {"title": final}
+			if final in revisions:
+				revs = revisions[final]
+				if "rvstart" in params:
+					revs = [r for r in revs if r[1] <= params["rvstart"]]
+				if revs:
+					page["revisions"] = [{"revid": revs[0][0], "timestamp": revs[0][1]}]
+			else:
+				page["missing"] = ""
+			query["pages"][str(-1 - i)] = page
+		return query
+
+	def log_message(self, format, *args):
+		pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), ApiHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+wiki.wiki_url = "http://127.0.0.1:%d" % server.server_port
+
+titles = ["Stone", "Iron_Door", "/Oak_Fence/", "Glazed_Terracotta", "Nothing"]
+urls = find_revision_urls(titles, date(2017, 6, 7))
+print(urls)
+assert urls["Stone"] == wiki.wiki_url + "/index.php?title=Stone&oldid=200"
+assert urls["Iron_Door"] == wiki.wiki_url + "/index.php?title=Door&oldid=210"
+assert urls["/Oak_Fence/"] == wiki.wiki_url + "/index.php?title=Fence&oldid=220"
+assert urls["Glazed_Terracotta"] is None  # created after the date
+assert urls["Nothing"] is None  # missing page
+# One batch, plus one query for each page whose latest revision is too recent
+assert len(queries) == 4, queries
+
+wiki.api_batch_size = 2
+queries.clear()
+assert find_revision_urls(titles, date(2017, 6, 7), jobs=4) == urls
+assert len(queries) == 6, queries
+assert find_revision_url("Stone", date(2016, 6, 1)) == wiki.wiki_url + "/index.php?title=Stone&oldid=100"
+server.shutdown()
+print("OK")
@@ -0,0 +1,118 @@
+import re
+import time
+from math import inf
+
+from datatractor.main.packets_rules import *
+
+
+def old_enum_start(field_notes: str):
+	"""The if/elif chain that the enum rules replace, to check that they give the same results."""
+	idx0 = None
+	if "-1:" in field_notes:
+		idx0 = field_notes.index("-1:")
+	elif "0:" in field_notes:
+		idx0 = field_notes.index("0:")
+	elif "0 :" in field_notes:
+		idx0 = field_notes.index("0 :")
+	elif "0x1:" in field_notes and "0x2:" in field_notes:
+		idx0 = field_notes.index("0x1:")
+	elif "0xF0 =" in field_notes:
+		is_semi_byte_a = (field_notes.count('=') == 2) and ("0x0F" in field_notes)
+		is_semi_byte_b = "4 most significant bits" in field_notes
+		if not is_semi_byte_a and not is_semi_byte_b:
+			idx0 = field_notes.index("0xF0 =")
+			field_notes = field_notes.replace(" =", ':').replace('=', ':')
+	elif "0 =" in field_notes and not "20 = full" in field_notes:
+		idx1 = field_notes.index("1 =") if "1 =" in field_notes else inf
+		idx0 = min(field_notes.index("0 ="), idx1)
+		field_notes = field_notes.replace(" =", ':').replace('=', ':')
+	elif "0=" in field_notes and "from y=0" not in field_notes:
+		idx1 = field_notes.index("1=") if "1=" in field_notes else inf
+		idx0 = min(field_notes.index("0="), idx1)
+		field_notes = field_notes.replace(" =", ':').replace('=', ':')
+	elif "1 for" in field_notes and "1 for every" not in field_notes:
+		idx0 = field_notes.index("1 for")
+		field_notes = field_notes.replace(" for", ':')
+	elif "North =" in field_notes and "," in field_notes:
+		idx0 = field_notes.index("North =")
+		field_notes = field_notes.replace("North = 2, South = 0, West = 1, East = 3",
+										  "0: South, 1: West, 2: North, 3: East")
+	elif "1 -" in field_notes and ("2 -" in field_notes or "0 -" in field_notes):
+		idx1 = field_notes.index("1 -")
+		idx0 = min(field_notes.index("0 -") if "0 -" in field_notes else inf, idx1)
+		field_notes = field_notes.replace(" -", ':').replace('-', ':')
+	return idx0, field_notes
+
+
+# Notes like the ones of wiki.vg, for each rule and for the cases where a rule must not apply
+notes = {
+	"The ID of the entity": None,
+	"-1: none, 0: survival, 1: creative": "minus_one_colon",
+	"Mode, 0: survival, 1: creative": "zero_colon",
+	"Slot 10: head": "zero_colon",
+	"0 : down, 1 : up": "zero_space_colon",
+	"Bit mask. 0x1: on fire, 0x2: crouched": "bitmask",
+	"Only 0x1: on fire": None,
+	"0xF0 = main, 0x0F = off": "semi_byte",
+	"The 4 most significant bits, 0xF0 = x": "semi_byte",
+	"0xF0 = x, 0x0E = y, 0x01 = z": "semi_byte",
+	"0 = chat box, 1 = system": "zero_space_equals",
+	"1 = second, 0 = first": "zero_space_equals",
+	"Health, 20 = full": None,
+	"0=left, 1=right": "zero_equals",
+	"Height from y=0": None,
+	"1 for a new line, 2 for nothing": "one_for",
+	"1 for every block": None,
+	"North = 2, South = 0, West = 1, East = 3": "directions",
+	"North = up": None,
+	"1 - start, 2 - stop": "dashes",
+	"Ends at 1 - done": None,
+	"Size 0xF0 = 240, 0 = none": "semi_byte",
+	"10: a, -1: b": "minus_one_colon",  # the priority, not the position, picks the rule
+}
+# No key is a prefix of another, so the single scan finds all of them
+assert not any(a.key != b.key and b.key.startswith(a.key) for a in enum_rules for b in enum_rules)
+rule_hits.clear()  # the counts of the modules imported before
+for text, expected in notes.items():
+	rule = find_enum_rule(text)
+	assert (rule and rule.name) == expected, (text, rule)
+	assert find_enum_start(text) == old_enum_start(text), text
+	# Each rule can be tested on its own
+	for r in enum_rules:
+		if r.name == expected:
+			assert r.matches(text)
+			break
+assert rule_hits["zero_colon"] == 2 and rule_hits["semi_byte"] == 4  # by find_enum_start only
+assert next(r for r in enum_rules if r.name == "bitmask").matches("0x1: a, 0x2: b")
+
+# The combined guard patterns behave like the successive re.match calls
+old_patterns = [("either", "(.+) is (.+) or (.+)"), ("not_equal", "(.+) does not equal (.+)"),
+				("more_than", "(.+) is more than (.+)"), ("less_than", "(.+) is less than (.+)"),
+				("equal", "(.+) is (.+)")]
+conditions = ["mode is 1 or 2", "action does not equal 3", "count is more than 0", "count is less than 5",
+			  "has target is true", "type is an item or a block", "always", "action is 0 or it is 1"]
+for c in conditions:
+	expected = next(((name, re.match(p, c)) for name, p in old_patterns if re.match(p, c)), (None, None))
+	rule, m = match_guard(c)
+	assert rule == expected[0], (c, rule)
+	if m is not None:
+		values = [m.group(f"{rule}_guard"), m.group(f"{rule}_value")]
+		assert values == list(expected[1].groups()[:2]), (c, values)
+		assert rule != "either" or m.group("either_value2") == expected[1].group(3)
+
+# Most notes have no enum: a few substring checks reject them, before any regex
+plain = "The entity's unique ID, as sent by the server; see the entity metadata format for the values of its fields"
+texts = [plain] * 9000 + list(notes) * 50
+old_time = new_time = inf
+for _ in range(5):  # the best of several runs, to ignore the warm-up and the noise
+	start = time.perf_counter()
+	old = [old_enum_start(t) for t in texts]
+	old_time = min(old_time, time.perf_counter() - start)
+	start = time.perf_counter()
+	new = [find_enum_start(t) for t in texts]
+	new_time = min(new_time, time.perf_counter() - start)
+assert old == new
+print("enum detection of %d notes, if/elif chain: %.1fms, rules: %.1fms" % (len(texts), old_time * 1000, new_time * 1000))
+assert new_time <= old_time, "the rules are slower than the if/elif chain"
+print("hits:", dict(rule_hits.most_common()))
+print("OK")
@@ -1,5 +1,7 @@
 import re
-from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
 from typing import Any, Union
 
 from bs4 import Tag
@@ -8,6 +10,8 @@ from datatractor.utils.html_tools import *
 from datatractor.utils.http_tools import *
 
 wiki_url = "https://minecraft.gamepedia.com"
+api_path = "/api.php"
+api_batch_size = 50  # maximum number of titles per API query
 redirections = {
 	"Flowers": "Flower",
 	"Iron_Door": "Door",
@@ -46,13 +50,13 @@ def extract_release_infos(game_version: str, major_only: bool):
 	:param major_only: True to inspect only the major versions, eg 1.11 and not 1.11.2
 	:return: release_date, next_version, next_date
 	"""
-	soup = robust_soup(page_url("Java_Edition_version_history"))
-	root = make_hierarchy(soup)[0]
+	html = robust_request(page_url("Java_Edition_version_history")).text
+	root = make_hierarchy(parse_html(html, content=wiki_content))[0]
 	next_version = None
 	next_date = date.today()
 	date_format = "%B %d, %Y"
 	table: HtmlTable
-	for table in root.recursive_findall(lambda e: isinstance(e, HtmlTable)):
+	for table in root.recursive_findall_type(HtmlTable):
 		if table.column_count() == 2 and get_text(table.get(0, 0)) == "Version":
 			if major_only:
 				rows = table.rows[table.row_count() - 1:]
@@ -73,31 +77,97 @@ def extract_release_infos(game_version: str, major_only: bool):
 	return None, None, None  # not found
 
 
-def find_revision_url(page_title: str, before_date: date):
+def find_revision_url(page_title: str, before_date: date, session=None):
 	"""
 	Searches the most up-to-date revision of the given page before the given date.
 	:param page_title: the page to search
 	:param before_date: the date to search before
+	:param session: the HTTP session to use, defaults to the shared one
 	:return: the URL pointing to the corresponding revision of the page, or None if not found
 	"""
-	if page_title.startswith("/"):
-		page_title = page_title[1:]
-	if page_title.endswith("/"):
-		page_title = page_title[:-1]
-	history_url = "%s/index.php?title=%s&action=history&year=%s&month=%s&tagfilter=" % (
-		wiki_url, page_title, before_date.year, before_date.month)
-	html = robust_request(history_url).text
-	# This request sometimes returns an empty string, for no apparent reason.
-	# In that case, we clear the cache and do the request again. This is done by robust_request()
-	soup = BeautifulSoup(html, "lxml")
-	date_format = "%H:%M, %d %B %Y"
-
-	for revision in soup.find_all("a", {"class": "mw-changeslist-date"}):
-		revision_date = datetime.strptime(get_text(revision), date_format).date()
-		# DEBUG print(page_title, revision_date)
-		if revision_date < before_date:
-			return page_url(revision["href"])
-	return None
+	return find_revision_urls([page_title], before_date, session)[page_title]
+
+
+def find_revision_urls(page_titles: list, before_date: date, session=None, jobs: int = 1):
+	"""
+	Searches the most up-to-date revisions of several pages before the given date, with the MediaWiki API.
+	The titles are normalized, redirected and checked by batches of api_batch_size titles.
+	Only the pages whose latest revision is too recent need an additional (small) query.
+	:param page_titles: the pages to search
+	:param before_date: the date to search before
+	:param session: the HTTP session to use, defaults to the shared one
+	:param jobs: the number of additional queries to run concurrently
+	:return: a dict that maps each title to the URL of its revision, or to None if not found
+	"""
+	# Searches the revisions made before the day before_date, like the history page would
+	start = datetime.combine(before_date, datetime.min.time()) - timedelta(seconds=1)
+	rvstart = start.strftime("%Y-%m-%dT%H:%M:%SZ")
+	titles = {}  # original title -> title queried
+	for original in page_titles:
+		title = original
+		if title.startswith("/"):
+			title = title[1:]
+		if title.endswith("/"):
+			title = title[:-1]
+		titles[original] = title
+
+	queried = list(dict.fromkeys(titles.values()))
+	resolved = {}  # title queried -> (final title, latest revision or None)
+	for i in range(0, len(queried), api_batch_size):
+		batch = queried[i:i + api_batch_size]
+		query = api_query(session, titles="|".join(batch), prop="revisions", rvprop="ids|timestamp", redirects=1)
+		aliases = {}
+		for alias in query.get("normalized", []) + query.get("redirects", []):
+			aliases[alias["from"]] = alias["to"]
+		pages = {}
+		for page in query.get("pages", {}).values():
+			revisions = page.get("revisions")
+			pages[page["title"]] = revisions[0] if revisions else None
+		for title in batch:
+			final = title
+			for _ in range(len(aliases)):  # bounded, in case of a redirection loop
+				if final not in aliases:
+					break
+				final = aliases[final]
+			resolved[title] = (final, pages.get(final))
+
+	def find_revid(title):
+		final, latest = resolved[title]
+		if latest is None:
+			return None
+		if latest["timestamp"] <= rvstart:  # ISO 8601 timestamps compare like dates
+			return latest["revid"]
+		query = api_query(session, titles=final, prop="revisions", rvprop="ids|timestamp",
+						  rvlimit=1, rvstart=rvstart, rvdir="older")
+		for page in query.get("pages", {}).values():
+			revisions = page.get("revisions")
+			if revisions:
+				return revisions[0]["revid"]
+		return None
+
+	if jobs > 1:
+		with ThreadPoolExecutor(max_workers=jobs) as executor:
+			revids = dict(zip(queried, executor.map(find_revid, queried)))
+	else:
+		revids = {title: find_revid(title) for title in queried}
+
+	urls = {}
+	for original, title in titles.items():
+		revid = revids[title]
+		if revid is None:
+			urls[original] = None
+		else:
+			final = resolved[title][0].replace(" ", "_")
+			urls[original] = page_url("/index.php?%s" % urlencode({"title": final, "oldid": revid}))
+	return urls
+
+
+def api_query(session=None, **params):
+	"""Sends a query to the wiki's API and returns the "query" part of the JSON response."""
+	params["action"] = "query"
+	params["format"] = "json"
+	url = "%s%s?%s" % (wiki_url, api_path, urlencode(params))
+	return robust_request(url, session=session).json().get("query", {})
 
 
 def real_page(page_title: str):
@@ -1,24 +1,110 @@
+import gzip
+import hashlib
+import os
+import pickle
+import threading
 from typing import Callable, List
 
-from bs4 import BeautifulSoup, NavigableString
+import lxml.html
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
 from bs4.element import Tag
+from lxml import etree
 
-from utils.string_tools import pretty_matrix_str
+from datatractor.utils.string_tools import pretty_matrix_str
 
 headings = ["h1", "h2", "h3", "h4", "h5", "h6"]
 ignore_del = True
+backend = "bs4"  # the parser used by parse_html: "bs4" (BeautifulSoup) or "lxml" (native lxml elements, faster)
+backends = ["bs4", "lxml"]
+wiki_content = ["firstHeading", "mw-content-text"]  # the ids of the title and of the article in MediaWiki pages
+tree_cache = None  # the directory of the cached hierarchies, see cached_hierarchy, or None to disable the cache
+PARSER_VERSION = 2  # to increment when the parsed hierarchies change, to invalidate the cached ones
+_ascii_spaces = " \n\t\f\r"
+_whitespace_tags = ("pre", "textarea")
 
 
-def is_stroke_through(t: Tag):
-	style = t.attrs.get("style")
+def parse_html(html: str, parser: str = None, content: List[str] = None):
+	"""
+	Parses an HTML document with the given backend.
+	:param html: the HTML code
+	:param parser: "bs4" or "lxml", or None to use the default backend
+	:param content: the ids of the tags to keep, eg wiki_content, or None to keep the whole document. The other tags,
+	like the navigation and the footer, are dropped while parsing. If none of the ids is found, the whole document is kept
+	:return: a BeautifulSoup object, or the root lxml element of the document
+	"""
+	parser = parser or backend
+	if parser == "lxml":
+		html_parser = lxml.html.HTMLParser(huge_tree=True)  # doesn't stop at 255 nested tags, like bs4
+		try:
+			document = lxml.html.document_fromstring(html, parser=html_parser)
+		except ValueError:  # unicode string with an encoding declaration
+			document = lxml.html.document_fromstring(html.encode("utf-8"), parser=html_parser)
+		return select_lxml_content(document, content) if content else document
+	elif parser == "bs4":
+		if content:
+			soup = BeautifulSoup(html, "lxml", parse_only=SoupStrainer(id=content))
+			if len(soup.contents) > 0:
+				return soup
+		return BeautifulSoup(html, "lxml")
+	raise ValueError(f"Unknown HTML parser {parser}, expected one of {backends}")
+
+
+def select_lxml_content(document, content: List[str]):
+	"""
+	Moves the elements with the given ids to a new document, like the SoupStrainer of bs4 does while parsing.
+	The rest of the document is freed without ever being seen by python.
+	:return: the new document, or the given one if none of the ids is found
+	"""
+	condition = " or ".join(f"@id = $id{i}" for i in range(len(content)))
+	variables = {f"id{i}": html_id for i, html_id in enumerate(content)}
+	selected = []
+	for element in document.xpath(f"//*[{condition}]", **variables):
+		if not any(parent in selected for parent in element.iterancestors()):  # already in a selected element
+			selected.append(element)
+	if len(selected) == 0:
+		return document
+	root = lxml.html.Element("html")
+	body = etree.SubElement(root, "body")
+	for element in selected:
+		element.tail = None
+		body.append(element)
+	return root
+
+
+def find_tags(document, name: str, css_class: str = None):
+	"""
+	Finds the tags with the given name and, optionally, the given class, in a document of any backend.
+	:return: a generator of the matching tags, in the document order
+	"""
+	if isinstance(document, etree._Element):
+		for tag in document.iterdescendants(name):
+			if css_class is None or css_class in (tag.get("class") or "").split():
+				yield tag
+	else:
+		yield from document.find_all(name, {"class": css_class} if css_class else {})
+
+
+def tag_name(element):
+	"""Returns the name of an element of any backend, or None if it isn't a tag."""
+	if isinstance(element, etree._Element):
+		return element.tag if isinstance(element.tag, str) else None
+	return getattr(element, "name", None)
+
+
+def is_stroke_through(t):
+	style = t.get("style") if isinstance(t, etree._Element) else t.attrs.get("style")
 	return ("decoration: line-through" in style) if style else False
 
 
 def get_text(element, joiner=" "):
-	if element is None:
+	if type(element) is str:
+		return element
+	elif element is None:
 		return None
 	elif isinstance(element, HtmlCell):
-		return get_text(element.content)
+		return element.text()
+	elif isinstance(element, InlineContent):
+		return element.text
 	elif isinstance(element, list):
 		if len(element) == 1:
 			return get_text(element[0])
@@ -28,15 +114,21 @@ def get_text(element, joiner=" "):
 		if element.name == "del" and ignore_del:
 			return None
 		return get_text(element.contents)
+	elif isinstance(element, etree._Element):
+		if element.tag == "del" and ignore_del:
+			return None
+		return get_text(lxml_contents(element))
 	else:
 		return str(element)
 
 
 def get_link(element):
-	if element is None:
+	if element is None or type(element) is str:
 		return None
 	elif isinstance(element, HtmlCell):
-		return get_link(element.content)
+		return element.link()
+	elif isinstance(element, InlineContent):
+		return element.link
 	elif isinstance(element, list):
 		for e in element:
 			link = get_link(e)
@@ -45,50 +137,138 @@ def get_link(element):
 		return None
 	elif isinstance(element, Tag) and element.has_attr("href"):
 		return element["href"]
+	elif isinstance(element, etree._Element) and "href" in element.attrib:
+		return element.get("href")
 	else:
 		return None
 
 
-def make_hierarchy(soup: BeautifulSoup, trim: bool = True):
-	"""Organizes an HTML document according to its headings (h1, h2, etc.)."""
-	itr = flatten(soup.find("body"), trim)
+def make_hierarchy(document, trim: bool = True, detached: bool = False, lazy: bool = True):
+	"""
+	Organizes an HTML document according to its headings (h1, h2, etc.).
+	:param document: a BeautifulSoup object or a root lxml element, whole or restricted to its content, see parse_html
+	:param trim: True to strip the strings and drop the blank ones
+	:param detached: True to replace the tags by their InlineContent and the strings by plain str, so that the
+	sections don't reference the document anymore. The sections can then be pickled, and the document freed
+	:param lazy: True to parse the tables and lists of each section on the first access to its content, only
+	possible when the sections aren't detached. detach_section detaches the lazy sections afterwards, parsing only the
+	needed ones
+	:return: the list of the top-level sections
+	"""
+	lazy = lazy and not detached
+	if isinstance(document, etree._Element):
+		itr = flatten_lxml(next(document.iter("body")), trim, detached, not lazy)
+	else:
+		body = document.find("body")
+		itr = flatten(document if body is None else body, trim, detached, not lazy)  # filtered documents have no body
 	sections = []
 
 	next_heading = None
 	for tag in itr:
-		if tag.name in headings:
+		if tag_name(tag) in headings:
 			next_heading = tag
 			break
 
-	while next_heading:
+	while next_heading is not None:
 		level, html_id, title = inspect_heading(next_heading)
-		section, next_heading = make_section(itr, level, html_id, title)
+		section, next_heading = make_section(itr, level, html_id, title, detached, lazy, trim)
 		sections.append(section)
 
 	return sections
 
 
-def make_section(itr, level, html_id, title):
+def install_tree_cache(directory: str):
+	"""Enables the cache of the hierarchies made by cached_hierarchy, stored in the given directory."""
+	global tree_cache
+	os.makedirs(directory, exist_ok=True)
+	tree_cache = directory
+
+
+def cached_hierarchy(html: str, content: List[str] = None, trim: bool = True, ids: List[str] = None):
+	"""
+	Makes the detached hierarchy of an HTML page, like make_hierarchy(parse_html(html, content=content), trim, True),
+	or loads it from the tree cache if the same page has already been parsed by the same version of the same backend.
+	:param ids: the ids of the only sections to parse, see detach_section, or None to parse the whole page
+	:return: the list of the top-level sections
+	"""
+	if tree_cache is None:
+		return _detached_hierarchy(html, content, trim, ids)
+	key = hashlib.sha256(f"{PARSER_VERSION}|{backend}|{content}|{trim}|{ids}|".encode("utf-8"))
+	key.update(html.encode("utf-8"))
+	digest = key.hexdigest()
+	path = os.path.join(tree_cache, digest[:2], f"{digest}.pickle.gz")
+	if os.path.isfile(path):
+		try:
+			with open(path, "rb") as f:
+				return pickle.loads(gzip.decompress(f.read()))
+		except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+			print("WARNING - Ignoring the invalid cached hierarchy %s: %s" % (path, e))
+	sections = _detached_hierarchy(html, content, trim, ids)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp = f"{path}.{threading.get_ident()}.tmp"
+	with open(tmp, "wb") as f:
+		f.write(gzip.compress(pickle.dumps(sections, pickle.HIGHEST_PROTOCOL), 1))
+	os.replace(tmp, path)
+	return sections
+
+
+def _detached_hierarchy(html: str, content: List[str], trim: bool, ids: List[str]):
+	if ids is None:
+		return make_hierarchy(parse_html(html, content=content), trim, detached=True)
+	sections = (detach_section(s, ids) for s in make_hierarchy(parse_html(html, content=content), trim))
+	return [s for s in sections if s is not None]
+
+
+def detach_section(section: "HtmlSection", ids: List[str] = None):
+	"""
+	Makes a detached copy of a lazy section made by make_hierarchy, see its detached parameter, parsing only the kept
+	sections.
+	:param ids: the ids of the sections to keep with all their content, or None to keep everything. The other sections
+	are dropped, unless they contain a kept one: then they keep only the sub-sections that lead to the kept ones
+	:return: the detached section, or None if it's dropped
+	"""
+	keep = ids is None or section.html_id in ids
+	content = []
+	for e in section.content if section.is_parsed() else section._raw:
+		if isinstance(e, HtmlSection):
+			sub = detach_section(e, None if keep else ids)
+			if sub is not None:
+				content.append(sub)
+		elif keep:
+			content.append(detach(e if section.is_parsed() else parse_element(e, section._trim, True)))
+	if not keep and not content:
+		return None
+	title = None if section.title is None else str(section.title)
+	return HtmlSection(section.level, title, section.html_id, content)
+
+
+def make_section(itr, level, html_id, title, detached: bool = False, lazy: bool = False, trim: bool = True):
 	"""Creates an HtmlSection whose content starts at the next tag given by itr."""
 	content = []
 	next_tag = next(itr, None)
-	while next_tag:
-		if next_tag.name in headings:
+	while next_tag is not None:
+		if tag_name(next_tag) in headings:
 			next_level, next_html_id, next_title = inspect_heading(next_tag)
 			if next_level <= level:
 				break
 			else:
-				section, next_tag = make_section(itr, next_level, next_html_id, next_title)
+				section, next_tag = make_section(itr, next_level, next_html_id, next_title, detached, lazy, trim)
 				content.append(section)
 		else:
-			content.append(next_tag)
+			content.append(detach(next_tag) if detached else next_tag)
 			next_tag = next(itr, None)
 
+	if detached and title is not None:
+		title = str(title)
+	if lazy:
+		return HtmlSection(level, title, html_id, raw=content, trim=trim), next_tag
 	return HtmlSection(level, title, html_id, content), next_tag
 
 
-def inspect_heading(h: Tag):
+def inspect_heading(h):
 	"""Extracts the informations about an html heading tag."""
+	if isinstance(h, etree._Element):
+		return inspect_heading_lxml(h)
 	level = int(h.name[1])  # for ex. gets the "2" in "h2"
 	html_id = None
 	title = None
@@ -124,16 +304,40 @@ def contains_list(tag: Tag):
 	return tag.find(["ol", "ul"])
 
 
-def flatten(container: Tag, trim: bool):
-	"""Iterates over the children of the container, flattening the <div> tags and parsing the <table> tags."""
-	for c in container.children:
+def find_containers(container: Tag) -> set:
+	"""
+	Finds the tags that contain an html heading or table, in a single pass: the ancestors of each heading and table
+	are marked until an already marked one is reached, so that each tag is visited once.
+	:return: the set of the ids of the tags inside the container that contain a heading or a table
+	"""
+	containers = set()
+	for tag in container.find_all(headings + ["table"]):
+		parent = tag.parent
+		while parent is not container and id(parent) not in containers:
+			containers.add(id(parent))
+			parent = parent.parent
+	return containers
+
+
+def flatten(container: Tag, trim: bool, detached: bool = False, parse: bool = True):
+	"""
+	Iterates over the children of the container, flattening the <div> tags and parsing the <table> tags.
+	:param parse: False to give the <table>, <ol> and <ul> tags as they are, to parse them later with parse_element
+	"""
+	containers = find_containers(container)
+	stack = [iter(container.children)]
+	while stack:
+		c = next(stack[-1], None)
+		if c is None:
+			stack.pop()
+			continue
 		is_tag = isinstance(c, Tag)
-		if is_tag and (contains_headings(c) or contains_table(c)):
-			yield from flatten(c, trim)
+		if is_tag and id(c) in containers:
+			stack.append(iter(c.children))
 		elif is_tag and c.name == "table":
-			yield parse_table(c, trim)
+			yield parse_table(c, trim, detached) if parse else c
 		elif is_tag and c.name in ["ol", "ul"]:
-			yield parse_list(c, trim)
+			yield parse_list(c, trim, detached) if parse else c
 		else:
 			if trim and isinstance(c, str):
 				trimmed = c.strip()
@@ -143,8 +347,20 @@ def flatten(container: Tag, trim: bool):
 				yield c
 
 
-def parse_list(list: Tag, trim: bool):
+def parse_element(element, trim: bool, detached: bool = False):
+	"""Parses an element given by flatten(parse=False): the tables and lists are parsed, the rest is unchanged."""
+	name = tag_name(element)
+	if name == "table":
+		return parse_table(element, trim, detached)
+	elif name == "ol" or name == "ul":
+		return parse_list(element, trim, detached)
+	return element
+
+
+def parse_list(list, trim: bool, detached: bool = False):
 	"""Parses a <ol></ol> or <ul></ul> and produces an HtmlList."""
+	if isinstance(list, etree._Element):
+		return parse_list_lxml(list, trim, detached)
 	elements = []
 	ordered = (list.name == "ol")
 	for e in list.find_all("li"):
@@ -153,10 +369,10 @@ def parse_list(list: Tag, trim: bool):
 			inside = inside[0]
 		if isinstance(inside, Tag):
 			if inside.name in ["ol", "ul"]:
-				elements.append(parse_list(inside, trim))
+				elements.append(parse_list(inside, trim, detached))
 				continue
 			elif inside.name == "table":
-				elements.append(parse_table(inside, trim))
+				elements.append(parse_table(inside, trim, detached))
 				continue
 		if trim and isinstance(e, str):
 			trimmed = e.strip()
@@ -169,93 +385,319 @@ def parse_list(list: Tag, trim: bool):
 	return HtmlList(elements, ordered)
 
 
-def parse_table(table: Tag, trim: bool):
-	"""Parses a <table></table> and produces an HtmlTable."""
-	# First, we need to construct the arrays with the right number of rows and columns, in order to
-	# make the rowspan and colspan work
-	row_count = 0
-	col_count = 0
-	for tr in table.find_all("tr"):
-		row_count += 1
-		if row_count == 1:
-			for td in tr.find_all(["th", "td"]):
-				if td.has_attr("colspan"):
-					col_count += int(td["colspan"])
-				else:
-					col_count += 1
-		elif ignore_del:
-			if all(is_stroke_through(td) for td in tr.find_all(["th", "td"])):
-				row_count -= 1
+def parse_table(table, trim: bool, detached: bool = False):
+	"""
+	Parses a <table></table> and produces an HtmlTable.
+	:param detached: True to store the InlineContent of the cells instead of their tags, see make_hierarchy
+	"""
+	if isinstance(table, etree._Element):
+		return parse_table_lxml(table, trim, detached)
+	return build_table([read_cell(td, trim, detached) for td in tr.find_all(["th", "td"])]
+					   for tr in table.find_all("tr"))
+
+
+def read_cell(td: Tag, trim: bool, detached: bool = False):
+	"""Reads a <td> or <th> tag and returns its (content, is_header, is_deleted, rowspan, colspan)."""
+	# Gets cell content and trims it if required
+	cell_content: List = td.contents
+	if trim:
+		clean_cell = []
+		for e in cell_content:
+			if isinstance(e, str):
+				trimmed = e.strip()
+				if len(trimmed) > 0:
+					clean_cell.append(NavigableString(trimmed))
+			else:
+				clean_cell.append(e)
+		cell_content = clean_cell
+
+	if len(cell_content) == 0:
+		cell_content = None
+	elif len(cell_content) == 1:
+		cell_content = cell_content[0]
+
+	if detached:
+		cell_content = detach(cell_content)
+
+	rowspan = int(td["rowspan"]) if td.has_attr("rowspan") else 1
+	colspan = int(td["colspan"]) if td.has_attr("colspan") else 1
+	return cell_content, td.name == "th", is_stroke_through(td), rowspan, colspan
 
-	rows: List[List[HtmlCell]] = []
-	for i in range(0, row_count):
-		row = [None] * col_count
-		rows.append(row)
 
-	# Then we can fill the arrays with the cells' content
-	tr: Tag
-	td: Tag
-	i: int = 0  # row index
-	for tr in table.find_all("tr"):
+def build_table(rows_cells) -> "HtmlTable":
+	"""
+	Builds an HtmlTable in a single pass over its rows, respecting the rowspan and colspan of the cells.
+	The rows grow as needed and the table is as wide as its widest row, the missing cells are None.
+	When ignore_del is True, the rows (except the first one) whose cells are all stroke through are skipped,
+	but they still count for the rowspans that cross them. The rows without any cell, like spacers, are kept as rows of
+	None, so that the indexes of the next rows match the document.
+	:param rows_cells: an iterable of rows, each row being a list of (content, is_header, is_deleted, rowspan, colspan)
+	:return: the HtmlTable
+	"""
+	rows: List[List[HtmlCell]] = []
+	spans = {}  # column index -> [RefCell of a BigCell, number of rows it still covers]
+	for cells in rows_cells:
+		if ignore_del and rows and cells and all(cell[2] for cell in cells):
+			consume_spans(spans)  # the deleted row is skipped
+			continue
+		row = []
+		new_spans = {}
 		j: int = 0  # column index
-		for td in tr.find_all(["th", "td"]):
-			# Skips already populated cells, eg by rowspan or colspan
-			while (j < col_count) and (rows[i][j] is not None):
+		for content, is_header, is_deleted, rowspan, colspan in cells:
+			# Skips the cells occupied by the rowspans of the previous rows
+			while j in spans:
 				j += 1
 
-			# Remembers if it's a tr or th
-			is_header = (td.name == "th")
-
-			# Detects if it's deleted
-			is_deleted = is_stroke_through(td)
-
-			# Gets cell content and trims it if required
-			cell_content: List = td.contents
-			if trim:
-				clean_cell = []
-				for e in cell_content:
-					if isinstance(e, str):
-						trimmed = e.strip()
-						if len(trimmed) > 0:
-							clean_cell.append(NavigableString(trimmed))
-					else:
-						clean_cell.append(e)
-				cell_content = clean_cell
-
-			if len(cell_content) == 0:
-				cell_content = None
-			elif len(cell_content) == 1:
-				cell_content = cell_content[0]
-
 			# Populates the cell(s) and respects rowspan and colspan if present
-			ispan = int(td["rowspan"]) if td.has_attr("rowspan") else 1
-			jspan = int(td["colspan"]) if td.has_attr("colspan") else 1
-			ispan = max(ispan, 1)  # fix values <= 0
-			jspan = max(jspan, 1)  # fix values <= 0
+			ispan = max(rowspan, 1)  # fix values <= 0
+			jspan = max(colspan, 1)  # fix values <= 0
 			if ispan == jspan == 1:
-				rows[i][j] = HtmlCell(cell_content, is_header, is_deleted)
+				put_cell(row, j, HtmlCell(content, is_header, is_deleted))
 			else:
-				ref = BigCell(cell_content, is_header, is_deleted, ispan, jspan)
-				for xi in range(i, min(i + ispan, row_count)):
-					for xj in range(j, min(j + jspan, col_count)):
-						if xi == i and xj == j:
-							rows[xi][xj] = ref
-						else:
-							rows[xi][xj] = RefCell(ref)
-
+				ref = BigCell(content, is_header, is_deleted, ispan, jspan)
+				covered = RefCell(ref)  # shared by all the cells covered by the BigCell
+				put_cell(row, j, ref)
+				for xj in range(j + 1, j + jspan):
+					put_cell(row, xj, covered)
+				if ispan > 1:
+					for xj in range(j, j + jspan):
+						new_spans[xj] = [covered, ispan - 1]
 			j += jspan
-		i += 1
+
+		for xj, (covered, _) in spans.items():
+			put_cell(row, xj, covered)
+		consume_spans(spans)
+		spans.update(new_spans)
+		rows.append(row)
+
+	col_count = max((len(row) for row in rows), default=0)
+	for row in rows:
+		if len(row) < col_count:
+			row.extend([None] * (col_count - len(row)))
 	return HtmlTable(rows)
 
 
+def consume_spans(spans: dict):
+	"""Moves the pending rowspans to the next row, and forgets the ones that end."""
+	for xj in list(spans):
+		span = spans[xj]
+		span[1] -= 1
+		if span[1] == 0:
+			del spans[xj]
+
+
+def put_cell(row: list, j: int, cell):
+	"""Puts a cell in the j-th column of the row, growing the row if needed."""
+	if j >= len(row):
+		row.extend([None] * (j + 1 - len(row)))
+	row[j] = cell
+
+
+# Native lxml backend: builds the same structures as above directly from the lxml elements, without the
+# overhead of a BeautifulSoup tree. The texts are plain str, and the comments are replaced by their text like bs4 does.
+
+def lxml_contents(element) -> list:
+	"""Returns the children of an lxml element, texts included, like Tag.contents."""
+	contents = []
+	if element.text is not None:
+		contents.append(lxml_string(element.text, element))
+	for child in element:
+		if isinstance(child.tag, str):
+			contents.append(child)
+		elif child.tag is etree.Comment:
+			contents.append(child.text or "")
+		if child.tail is not None:
+			contents.append(lxml_string(child.tail, element))
+	return contents
+
+
+def lxml_string(text: str, parent) -> str:
+	"""Collapses the blank strings like bs4 does, except in the tags that preserve the whitespaces."""
+	if text.strip(_ascii_spaces) or parent.tag in _whitespace_tags:
+		return text
+	if next(parent.iterancestors(*_whitespace_tags), None) is not None:
+		return text
+	return "\n" if "\n" in text else " "
+
+
+def find_lxml_containers(container) -> set:
+	"""Finds the lxml elements that contain an html heading or table, like find_containers."""
+	containers = set()
+	for element in container.iterdescendants(*headings, "table"):
+		for parent in element.iterancestors():
+			if parent is container or parent in containers:
+				break
+			containers.add(parent)
+	return containers
+
+
+def inspect_heading_lxml(h):
+	"""Extracts the informations about an html heading element."""
+	level = int(h.tag[1])
+	html_id = h.get("id")
+	title = None
+	contents = lxml_contents(h)
+	if len(contents) > 0:
+		c0 = contents[0]
+		if isinstance(c0, str):
+			title = c0
+		else:
+			if html_id is None:
+				html_id = c0.get("id")
+			c0_contents = lxml_contents(c0)
+			if len(c0_contents) > 0:
+				title = c0_contents[0]
+	return level, html_id, title
+
+
+def flatten_lxml(container, trim: bool, detached: bool = False, parse: bool = True):
+	"""Iterates over the children of the container, like flatten but for the lxml elements."""
+	containers = find_lxml_containers(container)
+	stack = [iter(lxml_contents(container))]
+	while stack:
+		c = next(stack[-1], None)
+		if c is None:
+			stack.pop()
+			continue
+		is_tag = not isinstance(c, str)
+		if is_tag and c in containers:
+			stack.append(iter(lxml_contents(c)))
+		elif is_tag and c.tag == "table":
+			yield parse_table_lxml(c, trim, detached) if parse else c
+		elif is_tag and c.tag in ["ol", "ul"]:
+			yield parse_list_lxml(c, trim, detached) if parse else c
+		elif trim and not is_tag:
+			trimmed = c.strip()
+			if len(trimmed) > 0:
+				yield trimmed
+		else:
+			yield c
+
+
+def parse_list_lxml(list_element, trim: bool, detached: bool = False):
+	"""Parses an <ol></ol> or <ul></ul> lxml element and produces an HtmlList."""
+	elements = []
+	ordered = (list_element.tag == "ol")
+	for e in list_element.iterdescendants("li"):
+		inside = lxml_contents(e)
+		if len(inside) == 1:
+			inside = inside[0]
+		if isinstance(inside, etree._Element):
+			if inside.tag in ["ol", "ul"]:
+				elements.append(parse_list_lxml(inside, trim, detached))
+				continue
+			elif inside.tag == "table":
+				elements.append(parse_table_lxml(inside, trim, detached))
+				continue
+		text = get_text(inside)
+		if text is not None:
+			elements.append(text)
+	return HtmlList(elements, ordered)
+
+
+def parse_table_lxml(table, trim: bool, detached: bool = False):
+	"""Parses a <table></table> lxml element and produces an HtmlTable."""
+	return build_table([read_lxml_cell(td, trim, detached) for td in tr.iterdescendants("th", "td")]
+					   for tr in table.iterdescendants("tr"))
+
+
+def read_lxml_cell(td, trim: bool, detached: bool = False):
+	"""Reads a <td> or <th> lxml element, like read_cell."""
+	cell_content = lxml_contents(td)
+	if trim:
+		clean_cell = []
+		for e in cell_content:
+			if isinstance(e, str):
+				trimmed = e.strip()
+				if len(trimmed) > 0:
+					clean_cell.append(trimmed)
+			else:
+				clean_cell.append(e)
+		cell_content = clean_cell
+
+	if len(cell_content) == 0:
+		cell_content = None
+	elif len(cell_content) == 1:
+		cell_content = cell_content[0]
+
+	if detached:
+		cell_content = detach(cell_content)
+
+	rowspan = int(td.get("rowspan")) if "rowspan" in td.attrib else 1
+	colspan = int(td.get("colspan")) if "colspan" in td.attrib else 1
+	return cell_content, td.tag == "th", is_stroke_through(td), rowspan, colspan
+
+
+def detach(content):
+	"""
+	Converts the content of a cell or a section to a form that doesn't reference the parsed document:
+	the strings become plain str and the tags, or lists of tags and strings, become InlineContent.
+	"""
+	if content is None or isinstance(content, (HtmlTable, HtmlList, HtmlSection, InlineContent)):
+		return content
+	elif isinstance(content, str):
+		return str(content)
+	return InlineContent(tag_name(content), get_text(content), get_link(content), inline_markup(content))
+
+
+def inline_markup(content, name: str = None, link: str = None, markup: list = None) -> list:
+	"""
+	Lists the pieces of text of a tag, or of a list of tags and strings, with the tag and the link around them.
+	:return: a list of (tag name, text, link) tuples, in the document order, without the deleted texts
+	"""
+	if markup is None:
+		markup = []
+	if isinstance(content, list):
+		for e in content:
+			inline_markup(e, name, link, markup)
+	elif isinstance(content, str):
+		markup.append((name, str(content), link))
+	elif isinstance(content, (Tag, etree._Element)):
+		content_name = tag_name(content)
+		if content_name == "del" and ignore_del:
+			return markup
+		link = get_link(content) or link
+		contents = content.contents if isinstance(content, Tag) else lxml_contents(content)
+		inline_markup(contents, content_name, link, markup)
+	return markup
+
+
 class HtmlSection:
-	"""Represents a hierarchized part of an HTML document"""
+	"""
+	Represents a hierarchized part of an HTML document.
+	The sub-sections are indexed by id and title, and the elements by type, on the first lookup that needs it.
+	A lazy section keeps the raw elements given by flatten, and parses its tables and lists on the first access to its
+	content. Its sub-sections are known without parsing anything.
+	"""
 
-	def __init__(self, level: int, title: str, html_id: str, content: List[Tag]):
+	def __init__(self, level: int, title: str, html_id: str, content: List[Tag] = None, raw: list = None,
+				 trim: bool = True):
+		"""
+		:param content: the elements of the section, sub-sections included
+		:param raw: for a lazy section, instead of the content, the elements given by flatten(parse=False)
+		:param trim: the trim parameter to use when parsing the raw elements
+		"""
 		self.level = level
 		self.title = title
 		self.html_id = html_id
-		self.content = content
+		self._content = content
+		self._raw = raw
+		self._trim = trim
+		self._types = None  # type -> content indexes
+		self._subs = None  # (sub-sections, id -> sub-section, title -> sub-section)
+		self._recursive_index = None  # (id -> section, title -> section) for all the sections below this one
+
+	@property
+	def content(self) -> list:
+		"""The elements of the section, sub-sections included. The first access parses the lazy sections."""
+		if self._raw is not None:
+			self._content = [parse_element(e, self._trim) for e in self._raw]
+			self._raw = None
+		return self._content
+
+	def is_parsed(self) -> bool:
+		"""Returns False if the section is lazy and its content hasn't been accessed yet."""
+		return self._raw is None
 
 	def __str__(self):
 		return "HtmlSection(level=%d, id=%s, title=%s, content_length=%d)" % (
@@ -345,12 +787,42 @@ class HtmlSection:
 			elif isinstance(e, HtmlSection):
 				yield from e.recursive_findall(f)
 
+	def find_type(self, t: type):
+		"""Finds the first element of the given type (exactly, subclasses excluded), or None."""
+		if t is HtmlSection:
+			subs = self.sub_index()[0]
+			return subs[0] if subs else None
+		indexes = self.type_index().get(t)
+		return self.content[indexes[0]] if indexes else None
+
+	def find_type_i(self, t: type):
+		"""Finds the first element of the given type and its index, or (None, -1) if not found."""
+		indexes = self.type_index().get(t)
+		return (self.content[indexes[0]], indexes[0]) if indexes else (None, -1)
+
+	def findall_type(self, t: type):
+		"""Iterates over the elements of the given type (exactly, subclasses excluded)."""
+		if t is HtmlSection:
+			return iter(self.sub_index()[0])
+		content = self.content
+		return (content[i] for i in self.type_index().get(t, ()))
+
+	def recursive_findall_type(self, t: type):
+		"""
+		Recursively iterates over the elements of the given type, in the document order, like recursive_findall.
+		This relies on the sub-sections being after the other elements, as made by make_hierarchy.
+		"""
+		yield from self.findall_type(t)
+		if t is not HtmlSection:  # like recursive_findall, doesn't look into the matching sections
+			for sub in self.subs():
+				yield from sub.recursive_findall_type(t)
+
 	def subs(self):
 		"""
 		Iterates over all the sub-sections of this section.
 		:return: an iterator of the sub-sections
 		"""
-		return self.findall(lambda e: isinstance(e, HtmlSection))
+		return self.findall_type(HtmlSection)
 
 	def tags(self):
 		"""
@@ -361,20 +833,116 @@ class HtmlSection:
 
 	def sub_id(self, html_id: str):
 		"""Finds the sub-section with the given id."""
-		return self.find(lambda e: isinstance(e, HtmlSection) and e.html_id == html_id)
+		return self.sub_index()[1].get(html_id)
 
 	def sub_title(self, title: str):
 		"""Finds the sub-section with the given title."""
-		return self.find(lambda e: isinstance(e, HtmlSection) and e.title == title)
+		return self.sub_index()[2].get(title)
+
+	def recursive_sub_id(self, html_id: str):
+		"""Finds the first section with the given id below this one, at any depth."""
+		return self.recursive_index()[0].get(html_id)
+
+	def recursive_sub_title(self, title: str):
+		"""Finds the first section with the given title below this one, at any depth."""
+		return self.recursive_index()[1].get(title)
+
+	def type_index(self):
+		"""
+		Indexes the content of this section by type, once. The content mustn't change afterwards.
+		:return: a dict type -> content indexes
+		"""
+		if self._types is None:
+			types = {}
+			for i, e in enumerate(self.content):
+				types.setdefault(type(e), []).append(i)
+			self._types = types
+		return self._types
+
+	def sub_index(self):
+		"""
+		Indexes the sub-sections of this section, once, without parsing the content of a lazy section.
+		:return: a tuple (sub-sections, id -> sub-section, title -> sub-section)
+		"""
+		if self._subs is None:
+			subs = [e for e in (self._content if self._raw is None else self._raw) if isinstance(e, HtmlSection)]
+			ids, titles = {}, {}
+			for sub in subs:
+				if sub.html_id is not None:
+					ids.setdefault(sub.html_id, sub)
+				if sub.title is not None:
+					titles.setdefault(sub.title, sub)
+			self._subs = subs, ids, titles
+		return self._subs
+
+	def recursive_index(self):
+		"""
+		Indexes all the sections below this one, once, by merging the indexes of the sub-sections.
+		When several sections have the same id or title, the first one in the document order is kept.
+		:return: a tuple (id -> section, title -> section)
+		"""
+		if self._recursive_index is None:
+			ids, titles = {}, {}
+			for sub in self.subs():
+				if sub.html_id is not None:
+					ids.setdefault(sub.html_id, sub)
+				if sub.title is not None:
+					titles.setdefault(sub.title, sub)
+				sub_ids, sub_titles = sub.recursive_index()
+				for key, section in sub_ids.items():
+					ids.setdefault(key, section)
+				for key, section in sub_titles.items():
+					titles.setdefault(key, section)
+			self._recursive_index = ids, titles
+		return self._recursive_index
+
+
+class InlineContent:
+	"""
+	The content of a tag, detached from the HTML document: its text and link as given by get_text and get_link,
+	and its pieces of text with their markup, see inline_markup.
+	"""
+	__slots__ = ("name", "text", "link", "markup")
+
+	def __init__(self, name: str, text: str, link: str, markup: list):
+		self.name = name
+		self.text = text
+		self.link = link
+		self.markup = markup
+
+	def __str__(self):
+		return "" if self.text is None else self.text
+
+	def __repr__(self):
+		return f"InlineContent({self.name}, \"{self.text}\", {self.link})"
 
 
 class HtmlCell:
 	"""A cell in a table"""
+	__slots__ = ("content", "is_header", "is_deleted", "_text", "_link", "_extracted")
 
 	def __init__(self, content, is_header, is_deleted=False):
 		self.content = content
 		self.is_header = is_header
 		self.is_deleted = is_deleted
+		self._extracted = False  # True when _text and _link are set
+
+	def text(self) -> str:
+		"""Returns the text of the cell, as given by get_text. It's computed once, on the first call."""
+		if not self._extracted:
+			self._extract()
+		return self._text
+
+	def link(self) -> str:
+		"""Returns the first link of the cell, as given by get_link. It's computed once, on the first call."""
+		if not self._extracted:
+			self._extract()
+		return self._link
+
+	def _extract(self):
+		self._text = get_text(self.content)
+		self._link = get_link(self.content)
+		self._extracted = True
 
 	def __str__(self) -> str:
 		prefix = "$" if self.is_header else ""
@@ -409,8 +977,9 @@ class HtmlCell:
 class BigCell(HtmlCell):
 	"""
 	A cell that lies in several rows and/or columns.
-	The BigCell is stored in its first table cell, the other occupied cells are filled with RefCells.
+	The BigCell is stored in its first table cell, the other occupied cells are filled with the same RefCell.
 	"""
+	__slots__ = ("rowspan", "colspan")
 
 	def __init__(self, content, is_header, is_deleted, rowspan, colspan):
 		super().__init__(content, is_header, is_deleted)
@@ -433,7 +1002,8 @@ class BigCell(HtmlCell):
 
 
 class RefCell(HtmlCell):
-	"""Reference to a BigCell"""
+	"""Reference to a BigCell, shared by all the cells that the BigCell covers"""
+	__slots__ = ("ref",)
 
 	def __init__(self, ref: BigCell):
 		super().__init__(ref.content, ref.is_header)
@@ -456,6 +1026,12 @@ class RefCell(HtmlCell):
 	def __repr__(self):
 		return str(self)
 
+	def text(self) -> str:
+		return self.ref.text()
+
+	def link(self) -> str:
+		return self.ref.link()
+
 	def is_up_ref(self):
 		return self.ref.row_count() > 1  # ref cell is vertical
 
@@ -465,6 +1041,7 @@ class RefCell(HtmlCell):
 
 class HtmlTable:
 	"""Represents an HTML table"""
+	__slots__ = ("rows",)
 
 	def __init__(self, rows: List[List[HtmlCell]]):
 		self.rows = rows
@@ -527,6 +1104,7 @@ class HtmlTable:
 
 class HtmlList:
 	"""Represents an HTML list, ordered or unordered"""
+	__slots__ = ("elements", "is_ordered")
 
 	def __init__(self, elements: list, ordered: bool):
 		self.elements = elements
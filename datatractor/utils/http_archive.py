@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import threading
+import zipfile
+
+
+class HttpArchive:
+	"""
+	A set of recorded HTTP responses, stored in a single portable zip file.
+	The file contains an index that maps each URL to its response's metadata, and the bodies, stored once each.
+	"""
+	index_name = "responses.json"
+
+	def __init__(self, path: str):
+		self.path = path
+		self.lock = threading.Lock()
+		self.responses = {}  # url -> {body, status, encoding, content_type, headers}
+		self.bodies = {}  # body name -> body
+
+	@staticmethod
+	def load(path: str):
+		"""Reads an archive from the disk."""
+		archive = HttpArchive(path)
+		with zipfile.ZipFile(path) as z:
+			archive.responses = json.loads(z.read(HttpArchive.index_name).decode("utf-8"))
+			for entry in archive.responses.values():
+				name = entry["body"]
+				if name not in archive.bodies:
+					archive.bodies[name] = z.read(name)
+		return archive
+
+	def save(self):
+		"""Writes the archive to the disk."""
+		with self.lock:
+			directory = os.path.dirname(self.path)
+			if directory:
+				os.makedirs(directory, exist_ok=True)
+			tmp = f"{self.path}.tmp"
+			with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as z:
+				z.writestr(HttpArchive.index_name, json.dumps(self.responses, indent=1, sort_keys=True))
+				for name in sorted({entry["body"] for entry in self.responses.values()}):
+					z.writestr(name, self.bodies[name])
+			os.replace(tmp, self.path)
+
+	def get(self, url: str):
+		"""
+		Gets a recorded response.
+		:return: a tuple (entry, body), or None if the URL hasn't been recorded
+		"""
+		entry = self.responses.get(url)
+		if entry is None:
+			return None
+		return entry, self.bodies[entry["body"]]
+
+	def put(self, url: str, body: bytes, status: int, encoding: str = None, content_type: str = None,
+			headers: dict = None):
+		"""
+		Records a response, replacing any previous response to the same URL.
+		:param headers: the response's headers, like the Location of a redirection
+		"""
+		name = "bodies/" + hashlib.sha256(body).hexdigest()
+		with self.lock:
+			self.bodies[name] = body
+			self.responses[url] = {"body": name, "status": status, "encoding": encoding,
+								   "content_type": content_type, "headers": headers}
+
+	def __len__(self):
+		return len(self.responses)
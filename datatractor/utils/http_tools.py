@@ -1,19 +1,502 @@
+import atexit
+import math
+import random
 import requests
-import requests_cache
+import threading
 import time
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qs, urlparse
 
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 
-def robust_request(url: str, retry_interval=0.0, retry_max=20):
-	response = requests.get(url)
-	with requests_cache.disabled():
-		retry_count = 0
-		while response.status_code == 200 and not response.text and retry_count < retry_max:
-			time.sleep(retry_interval)
-			response = requests.get(url)
-			retry_count += 1
+from datatractor.utils.html_tools import parse_html
+from datatractor.utils.http_archive import HttpArchive
+from datatractor.utils.page_store import PageStore
+
+pool_connections = 4  # number of hosts whose connections are kept alive
+pool_maxsize = 16  # number of kept-alive connections per host
+cache_policy = None  # CachePolicy of the installed cache, if any
+page_store = None  # PageStore of the installed cache, if any
+archive = None  # HttpArchive being recorded or replayed, if any
+replay_mode = False  # True to serve every request from the archive, without any network access
+hedger = None  # Hedger of the network requests, if hedging is enabled
+limiter = None  # HostLimiter of the network requests, if any
+_session = None
+
+
+class RetryPolicy:
+	"""
+	Describes how robust_request retries a request: per-attempt timeouts, exponential backoff with jitter
+	between the attempts, and an overall deadline.
+	The connection errors, the timeouts, the retry_statuses and the empty 200 responses are retried.
+	"""
+
+	def __init__(self, connect_timeout: float = 10.0, read_timeout: float = 60.0, max_retries: int = 8,
+				 backoff_base: float = 0.5, backoff_max: float = 30.0, jitter: float = 0.5, deadline: float = 300.0,
+				 retry_statuses=(429, 500, 502, 503, 504)):
+		"""
+		:param connect_timeout: the maximum time to establish a connection, in seconds
+		:param read_timeout: the maximum time to wait for the server between two bytes, in seconds
+		:param max_retries: the maximum number of retries after the first attempt
+		:param backoff_base: the delay before the first retry, doubled at each retry, in seconds
+		:param backoff_max: the maximum delay between two attempts, in seconds
+		:param jitter: the fraction of each delay that is randomized, between 0 and 1
+		:param deadline: the maximum time spent on a request, retries included, in seconds
+		:param retry_statuses: the HTTP statuses that are retried
+		"""
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.max_retries = max_retries
+		self.backoff_base = backoff_base
+		self.backoff_max = backoff_max
+		self.jitter = jitter
+		self.deadline = deadline
+		self.retry_statuses = retry_statuses
+
+	def timeout(self, remaining: float):
+		"""Returns the (connect, read) timeouts of an attempt, bounded by the remaining time."""
+		return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+	def must_retry(self, response) -> bool:
+		"""Returns True if the response is a failure that may succeed later."""
+		if response.status_code == 200:
+			return not response.content  # the wiki sometimes returns an empty page, for no apparent reason
+		return response.status_code in self.retry_statuses
+
+	def delay(self, retry: int, response=None) -> float:
+		"""Returns the delay before the given retry (1 for the first one), in seconds."""
+		retry_after = None if response is None else response.headers.get("Retry-After")
+		if retry_after:
+			try:
+				return max(0.0, float(retry_after))
+			except ValueError:
+				try:
+					date = parsedate_to_datetime(retry_after)
+					return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+				except (TypeError, ValueError):
+					pass
+		backoff = min(self.backoff_max, self.backoff_base * (2 ** (retry - 1)))
+		return backoff * (1 - self.jitter * random.random())
+
+
+retry_policy = RetryPolicy()  # default policy of robust_request
+
+
+class NotArchivedError(requests.ConnectionError):
+	"""Raised in replay mode when a request isn't in the archive. Retrying it is useless."""
+
+
+class CachePolicy:
+	"""
+	Decides how long a cached page stays valid, depending on its URL.
+	Pages that name a fixed revision never change, so they never expire. The others (latest revisions,
+	histories, indexes) expire after the configured timeout.
+	"""
+	NEVER_EXPIRE = -1
+
+	def __init__(self, expire_after: int):
+		self.default_expire_after = expire_after
+
+	def is_immutable(self, url: str) -> bool:
+		params = parse_qs(urlparse(url).query)
+		if "oldid" in params:
+			return True
+		# The last revision before a past date can't change: new revisions are always added at the end
+		rvstart = params.get("rvstart")
+		if rvstart:
+			now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+			return rvstart[0] < now
+		return False
+
+	def expire_after(self, url: str) -> int:
+		"""Returns the number of seconds the page stays valid, or NEVER_EXPIRE."""
+		return CachePolicy.NEVER_EXPIRE if self.is_immutable(url) else self.default_expire_after
+
+
+def install_cache(directory: str, expire_after: int, max_size: int = None):
+	"""
+	Installs a PageStore cache that follows a CachePolicy with the given timeout.
+	:param directory: the directory of the cache
+	:param expire_after: the timeout of the pages that don't name a fixed revision, in seconds
+	:param max_size: the maximum size of the cache in bytes, or None for no limit
+	"""
+	global cache_policy, page_store
+	cache_policy = CachePolicy(expire_after)
+	page_store = PageStore(directory, max_size)
+	atexit.register(page_store.close)
+	configure_session()  # the next session will use the cache
+
+
+class Hedger:
+	"""
+	Reduces the tail latency of the requests. When a request hasn't been answered after a given percentile
+	of the latencies observed on its host, a duplicate request is sent and the first response to arrive wins.
+	The duplicates of each host are limited to a fraction of its requests, so the load is never more than doubled.
+	"""
+
+	def __init__(self, percentile: float = 0.95, budget: float = 0.1, min_samples: int = 20, window: int = 200,
+				 max_workers: int = 32):
+		"""
+		:param percentile: the percentile of the observed latencies after which a request is duplicated
+		:param budget: the maximum number of duplicates per request of the same host, at most 1
+		:param min_samples: the number of latencies to observe on a host before duplicating its requests
+		:param window: the number of recent latencies kept per host
+		:param max_workers: the maximum number of requests sent at the same time
+		"""
+		self.percentile = percentile
+		self.budget = min(budget, 1.0)
+		self.min_samples = min_samples
+		self.window = window
+		self.executor = ThreadPoolExecutor(max_workers=max_workers)
+		self.lock = threading.Lock()
+		self.latencies = {}  # host -> deque of the recent latencies, in seconds
+		self.requests = {}  # host -> number of requests
+		self.hedges = {}  # host -> number of duplicated requests
+
+	def threshold(self, host: str):
+		"""Returns the delay after which the requests of the host are duplicated, or None if unknown yet."""
+		with self.lock:
+			samples = self.latencies.get(host)
+			if samples is None or len(samples) < self.min_samples:
+				return None
+			ordered = sorted(samples)
+		return ordered[max(0, math.ceil(self.percentile * len(ordered)) - 1)]
+
+	def send(self, send, request, **kwargs):
+		"""Sends a request with the given function, and duplicates it if it's too slow."""
+		host = urlparse(request.url).netloc
+		threshold = self.threshold(host)
+		with self.lock:
+			self.requests[host] = self.requests.get(host, 0) + 1
+		if threshold is None:
+			return self._timed_send(host, send, request, kwargs)
+		primary = self.executor.submit(self._timed_send, host, send, request, kwargs)
+		done, _ = wait([primary], timeout=threshold)
+		if done or not self._take_budget(host):
+			return primary.result()
+		hedge = self.executor.submit(self._timed_send, host, send, request.copy(), kwargs)
+		pending = [primary, hedge]
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				if future.exception() is None:
+					for loser in pending:
+						loser.add_done_callback(_close_response)
+					return future.result()
+		return primary.result()  # both failed: raises the primary's exception
+
+	def _take_budget(self, host: str) -> bool:
+		with self.lock:
+			hedges = self.hedges.get(host, 0)
+			if hedges + 1 > self.budget * self.requests[host]:
+				return False
+			self.hedges[host] = hedges + 1
+			return True
+
+	def _timed_send(self, host: str, send, request, kwargs):
+		start = time.monotonic()
+		response = send(request, **kwargs)
+		latency = time.monotonic() - start
+		with self.lock:
+			samples = self.latencies.get(host)
+			if samples is None:
+				samples = self.latencies[host] = deque(maxlen=self.window)
+			samples.append(latency)
+		return response
+
+
+def _close_response(future):
+	if future.exception() is None:
+		future.result().close()
+
+
+def enable_hedging(percentile: float = 0.95, budget: float = 0.1, min_samples: int = 20):
+	"""Enables the hedging of the network requests of the shared session, see Hedger."""
+	global hedger
+	hedger = Hedger(percentile, budget, min_samples, max_workers=2 * pool_maxsize)
+	configure_session()
+
+
+class HostLimiter:
+	"""
+	Limits the requests sent to each host, to avoid being throttled: a token bucket limits their rate
+	and a semaphore limits the number of requests in flight. The time spent waiting is measured.
+	"""
+
+	def __init__(self, rate: float = None, burst: int = 1, max_in_flight: int = None):
+		"""
+		:param rate: the maximum number of requests per second and per host, or None for no limit
+		:param burst: the number of requests that can be sent at once before the rate applies
+		:param max_in_flight: the maximum number of simultaneous requests per host, or None for no limit
+		"""
+		self.rate = rate
+		self.burst = burst
+		self.max_in_flight = max_in_flight
+		self.lock = threading.Lock()
+		self.buckets = {}  # host -> [tokens, last refill time]
+		self.semaphores = {}  # host -> BoundedSemaphore
+		self.wait_time = 0.0  # total time spent waiting, in seconds
+		self.waits = 0  # number of requests that had to wait
+
+	def acquire(self, host: str):
+		"""Waits until a request can be sent to the host."""
+		start = time.monotonic()
+		if self.max_in_flight is not None:
+			with self.lock:
+				semaphore = self.semaphores.get(host)
+				if semaphore is None:
+					semaphore = self.semaphores[host] = threading.BoundedSemaphore(self.max_in_flight)
+			semaphore.acquire()
+		if self.rate is not None:
+			with self.lock:
+				now = time.monotonic()
+				tokens, last = self.buckets.get(host, (self.burst, now))
+				tokens = min(self.burst, tokens + (now - last) * self.rate) - 1  # reserves a token
+				self.buckets[host] = (tokens, now)
+			if tokens < 0:
+				time.sleep(-tokens / self.rate)
+		waited = time.monotonic() - start
+		if waited > 0.001:
+			with self.lock:
+				self.wait_time += waited
+				self.waits += 1
+
+	def release(self, host: str):
+		"""Signals that a request to the host is complete."""
+		if self.max_in_flight is not None:
+			self.semaphores[host].release()
+
+
+def limit_hosts(rate: float = None, burst: int = 1, max_in_flight: int = None):
+	"""Limits the network requests of the shared session, see HostLimiter."""
+	global limiter
+	limiter = HostLimiter(rate, burst, max_in_flight)
+	configure_session()
+
+
+class NetworkAdapter(HTTPAdapter):
+	"""Transport adapter that sends the requests over the network, limiting and hedging them if enabled."""
+
+	def __init__(self, hedger: Hedger = None, limiter: HostLimiter = None, **kwargs):
+		super().__init__(**kwargs)
+		self.hedger = hedger
+		self.limiter = limiter
+
+	def send(self, request, **kwargs):
+		if self.hedger is None:
+			return self._limited_send(request, **kwargs)
+		return self.hedger.send(self._limited_send, request, **kwargs)
+
+	def _limited_send(self, request, **kwargs):
+		if self.limiter is None:
+			return super().send(request, **kwargs)
+		host = urlparse(request.url).netloc
+		self.limiter.acquire(host)
+		try:
+			return super().send(request, **kwargs)
+		finally:
+			self.limiter.release(host)
+
+
+class CachingAdapter(NetworkAdapter):
+	"""Transport adapter that serves the GET requests from a PageStore, and stores what it downloads."""
+
+	def __init__(self, store: PageStore, policy: CachePolicy, **kwargs):
+		super().__init__(**kwargs)
+		self.store = store
+		self.policy = policy
+
+	def send(self, request, **kwargs):
+		if request.method != "GET":
+			return super().send(request, **kwargs)
+		expire_after = self.policy.expire_after(request.url)
+		max_age = None if expire_after == CachePolicy.NEVER_EXPIRE else expire_after
+		cached = self.store.get(request.url, max_age)
+		if cached is not None:
+			entry, body = cached
+			return make_response(request, body, entry["status"], entry["encoding"], entry["content_type"],
+								 entry.get("headers"))
+		response = super().send(request, **kwargs)
+		# Empty bodies aren't stored, so that robust_request's retries reach the server.
+		# The redirections are stored with their Location, the session follows them to the next cached page.
+		if kwargs.get("stream"):
+			return response
+		if (response.status_code == 200 and response.content) or (
+				response.is_redirect and "Location" in response.headers):
+			self.store.put(request.url, response.content, response.status_code, response.encoding,
+						   response.headers.get("Content-Type"), stored_headers(response))
+		return response
+
+
+class RecordingAdapter(BaseAdapter):
+	"""Transport adapter that records in an HttpArchive every response given by another adapter."""
+
+	def __init__(self, inner: BaseAdapter, archive: HttpArchive):
+		super().__init__()
+		self.inner = inner
+		self.archive = archive
+
+	def send(self, request, **kwargs):
+		response = self.inner.send(request, **kwargs)
+		if not kwargs.get("stream"):
+			self.archive.put(request.url, response.content, response.status_code, response.encoding,
+							 response.headers.get("Content-Type"), stored_headers(response))
+		return response
+
+	def close(self):
+		self.inner.close()
+
+
+class ReplayAdapter(BaseAdapter):
+	"""Transport adapter that serves the responses recorded in an HttpArchive, and nothing else."""
+
+	def __init__(self, archive: HttpArchive):
+		super().__init__()
+		self.archive = archive
+
+	def send(self, request, **kwargs):
+		recorded = self.archive.get(request.url)
+		if recorded is None:
+			raise NotArchivedError(f"{request.url} isn't in the archive {self.archive.path}", request=request)
+		entry, body = recorded
+		return make_response(request, body, entry["status"], entry["encoding"], entry["content_type"],
+							 entry.get("headers"))
+
+	def close(self):
+		pass
+
+
+def record(path: str):
+	"""Records every response given by the shared session in an archive, saved when the program exits."""
+	global archive, replay_mode
+	archive = HttpArchive(path)
+	replay_mode = False
+	atexit.register(archive.save)
+	configure_session()
+
+
+def replay(path: str):
+	"""Serves every request of the shared session from an archive, without any network access."""
+	global archive, replay_mode
+	archive = HttpArchive.load(path)
+	replay_mode = True
+	configure_session()
+
+
+_transfer_headers = ("content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive")
+
+
+def stored_headers(response) -> dict:
+	"""
+	Returns the headers of a response to store with its body. The ones that describe the transfer are dropped, because
+	the stored body is already decoded.
+	"""
+	return {name: value for name, value in response.headers.items() if name.lower() not in _transfer_headers}
+
+
+
+def make_response(request, body: bytes, status: int = 200, encoding: str = None, content_type: str = None,
+				  headers: dict = None):
+	"""
+	Creates a Response to the given request, without any network access.
+	:param headers: the response's headers, like the Location of a redirection, which the session follows
+	"""
+	response = requests.Response()
+	response.status_code = status
+	response.reason = "OK" if status == 200 else None
+	response.headers = CaseInsensitiveDict(headers or {})
+	if content_type is not None:
+		response.headers["Content-Type"] = content_type
+	response.encoding = encoding
+	response._content = body
+	response._content_consumed = True  # there's no connection to release when following a redirection
+	response.url = request.url
+	response.request = request
 	return response
 
 
-def robust_soup(url: str, retry_interval=0.0, retry_max=20):
-	return BeautifulSoup(robust_request(url, retry_interval, retry_max).text, "lxml")
+def configure_session(connections: int = None, maxsize: int = None):
+	"""
+	Sets the pool parameters of the shared HTTP session. The session is (re)created on its next use.
+	:param connections: the number of hosts to keep a connection pool for
+	:param maxsize: the maximum number of kept-alive connections per host
+	"""
+	global pool_connections, pool_maxsize, _session
+	if connections is not None:
+		pool_connections = connections
+	if maxsize is not None:
+		pool_maxsize = maxsize
+	if _session is not None:
+		_session.close()
+		_session = None
+
+
+def get_session() -> requests.Session:
+	"""
+	Returns the HTTP session shared by every extractor, creating it if needed.
+	The session is created lazily so that it picks up the cache installed by xtract.py.
+	"""
+	global _session
+	if _session is None:
+		session = requests.Session()
+		if replay_mode:
+			adapter = ReplayAdapter(archive)
+		elif page_store is None:
+			adapter = NetworkAdapter(hedger, limiter, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+		else:
+			adapter = CachingAdapter(page_store, cache_policy, hedger=hedger, limiter=limiter,
+									 pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+		if archive is not None and not replay_mode:
+			adapter = RecordingAdapter(adapter, archive)
+		session.mount("http://", adapter)
+		session.mount("https://", adapter)
+		_session = session
+	return _session
+
+
+def robust_request(url: str, policy: RetryPolicy = None, session: requests.Session = None):
+	"""
+	Gets a web page, retrying on failure.
+	:param url: the URL of the page
+	:param policy: the RetryPolicy to follow, defaults to retry_policy
+	:param session: the HTTP session to use, defaults to the shared one
+	:return: the response, which may be a failure if the retries didn't succeed before the deadline
+	"""
+	if policy is None:
+		policy = retry_policy
+	if session is None:
+		session = get_session()
+	deadline = time.monotonic() + policy.deadline
+	retry = 0
+	while True:
+		response = None
+		error = None
+		try:
+			response = session.get(url, timeout=policy.timeout(deadline - time.monotonic()))
+			if not policy.must_retry(response):
+				return response
+		except NotArchivedError:
+			raise
+		except (requests.ConnectionError, requests.Timeout) as e:
+			error = e
+		retry += 1
+		delay = policy.delay(retry, response)
+		if retry > policy.max_retries or time.monotonic() + delay >= deadline:
+			if response is None:
+				raise error
+			return response
+		time.sleep(delay)
+
+
+def robust_soup(url: str, policy: RetryPolicy = None, session: requests.Session = None, content: list = None,
+				parser: str = None):
+	"""
+	Requests a page and parses it, see html_tools.parse_html.
+	:param content: the ids of the tags to keep, eg html_tools.wiki_content, or None to keep the whole page
+	:param parser: "bs4" or "lxml", or None to use html_tools.backend, which is set by --parser
+	"""
+	return parse_html(robust_request(url, policy, session).text, parser, content)
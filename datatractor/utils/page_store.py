@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+class PageStore:
+	"""
+	Stores web pages on disk. Each body is compressed (zstd if available, gzip otherwise) and stored once,
+	in a file named after the hash of its content. A small index maps the URLs to the hashes.
+	When a size limit is set, the least recently used pages are evicted to respect it.
+	The index is written every save_interval seconds at most, and by close().
+	"""
+	index_name = "index.json"
+
+	def __init__(self, directory: str, max_size: int = None, save_interval: float = 10.0):
+		"""
+		:param directory: the directory of the store, created if needed
+		:param max_size: the maximum total size of the compressed bodies, in bytes, or None for no limit
+		:param save_interval: the minimum time between two writes of the index by put(), in seconds
+		"""
+		self.directory = directory
+		self.max_size = max_size
+		self.save_interval = save_interval
+		self.lock = threading.RLock()
+		self.dirty = False
+		self.last_save = time.monotonic()
+		os.makedirs(directory, exist_ok=True)
+		index_path = os.path.join(directory, self.index_name)
+		if os.path.isfile(index_path):
+			with open(index_path, encoding="utf-8") as f:
+				self.index = json.load(f)
+		else:
+			self.index = {"urls": {}, "blobs": {}}
+		self.urls = self.index["urls"]  # url -> {hash, status, encoding, content_type, headers, time, access}
+		self.blobs = self.index["blobs"]  # hash -> {file, size}
+		self.refs = {}  # hash -> number of URLs
+		for entry in self.urls.values():
+			self.refs[entry["hash"]] = self.refs.get(entry["hash"], 0) + 1
+		self.total_size = sum(blob["size"] for blob in self.blobs.values())
+
+	def size(self) -> int:
+		"""Returns the total size of the stored bodies, in bytes."""
+		return self.total_size
+
+	def get(self, url: str, max_age: int = None):
+		"""
+		Gets a page from the store.
+		:param url: the URL of the page
+		:param max_age: the maximum age of the page in seconds, or None if the page never expires
+		:return: a tuple (entry, body), or None if the page isn't stored or is too old
+		"""
+		with self.lock:
+			entry = self.urls.get(url)
+			if entry is None:
+				return None
+			now = time.time()
+			if max_age is not None and now - entry["time"] > max_age:
+				return None
+			blob = self.blobs.get(entry["hash"])
+			path = None if blob is None else os.path.join(self.directory, blob["file"])
+			if path is None or not os.path.isfile(path):
+				self._remove_url(url)
+				return None
+			entry["access"] = now
+			self.dirty = True
+		# The blob is read without the lock, so a concurrent eviction may have deleted it: that's a miss
+		try:
+			with open(path, "rb") as f:
+				data = f.read()
+		except FileNotFoundError:
+			return None
+		return entry, _decompress(blob["file"], data)
+
+	def put(self, url: str, body: bytes, status: int = 200, encoding: str = None, content_type: str = None,
+			headers: dict = None):
+		"""
+		Stores a page, replacing any previous version of it.
+		:param headers: the response's headers, like the Location of a redirection
+		"""
+		digest = hashlib.sha256(body).hexdigest()
+		now = time.time()
+		with self.lock:
+			if digest not in self.blobs:
+				file, data = _compress(digest, body)
+				path = os.path.join(self.directory, file)
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+				tmp = f"{path}.{threading.get_ident()}.tmp"
+				with open(tmp, "wb") as f:
+					f.write(data)
+				os.replace(tmp, path)
+				self.blobs[digest] = {"file": file, "size": len(data)}
+				self.total_size += len(data)
+			self.refs[digest] = self.refs.get(digest, 0) + 1
+			previous = self.urls.get(url)
+			self.urls[url] = {"hash": digest, "status": status, "encoding": encoding, "content_type": content_type,
+							  "headers": headers, "time": now, "access": now}
+			if previous is not None:
+				self._release_blob(previous["hash"])
+			self.dirty = True
+			self.evict()
+			if time.monotonic() - self.last_save >= self.save_interval:
+				self.save()
+
+	def evict(self):
+		"""Removes the least recently used pages until the size limit is respected."""
+		if self.max_size is None:
+			return
+		with self.lock:
+			total = self.size()
+			if total <= self.max_size:
+				return
+			for url in sorted(self.urls, key=lambda u: self.urls[u]["access"]):
+				if total <= self.max_size:
+					break
+				digest = self.urls[url]["hash"]
+				size = self.blobs[digest]["size"]
+				if self._remove_url(url):
+					total -= size
+
+	def save(self):
+		"""Writes the index to the disk."""
+		with self.lock:
+			path = os.path.join(self.directory, self.index_name)
+			tmp = f"{path}.tmp"
+			with open(tmp, "w", encoding="utf-8") as f:
+				json.dump(self.index, f)
+			os.replace(tmp, path)
+			self.dirty = False
+			self.last_save = time.monotonic()
+
+	def close(self):
+		"""Writes the index if it has unsaved changes, like the pages' access times."""
+		if self.dirty:
+			self.save()
+
+	def _remove_url(self, url: str) -> bool:
+		"""Removes a URL and returns True if its body isn't used anymore and has been deleted."""
+		entry = self.urls.pop(url)
+		self.dirty = True
+		return self._release_blob(entry["hash"])
+
+	def _release_blob(self, digest: str) -> bool:
+		count = self.refs.get(digest, 0) - 1
+		if count > 0:
+			self.refs[digest] = count
+			return False  # still used by another URL
+		self.refs.pop(digest, None)
+		blob = self.blobs.pop(digest, None)
+		if blob is not None:
+			self.total_size -= blob["size"]
+			try:
+				os.remove(os.path.join(self.directory, blob["file"]))
+			except FileNotFoundError:
+				pass
+		return True
+
+
+def _compress(digest: str, body: bytes):
+	"""Returns the file name and the compressed data of a body."""
+	if zstandard is not None:
+		return f"{digest[:2]}/{digest}.zst", zstandard.ZstdCompressor().compress(body)
+	return f"{digest[:2]}/{digest}.gz", gzip.compress(body)
+
+
+def _decompress(file: str, data: bytes) -> bytes:
+	if file.endswith(".zst"):
+		if zstandard is None:
+			raise ImportError(f"The zstandard module is required to read {file}")
+		return zstandard.ZstdDecompressor().decompress(data)
+	return gzip.decompress(data)
@@ -124,6 +124,88 @@ def multireplace(string, replacements) -> str:
 	return regexp.sub(lambda match: replacements[match.group(0)], string)
 
 
+class KeywordMatcher:
+	"""
+	Finds all the keywords that occur in a text, in a single pass over the text (Aho-Corasick automaton).
+	Each keyword is associated to a list of values. The keywords can be added and removed at any time: the automaton is
+	completed on the next search.
+	"""
+
+	def __init__(self):
+		self._goto = [{}]  # the transitions of each node of the trie
+		self._keyword = [None]  # the keyword that ends at each node, if any
+		self._fail = [0]  # the node of the longest proper suffix of each node
+		self._outputs = [()]  # the nodes where keywords end, among each node and its suffixes
+		self._built = True
+		self.values = {}  # keyword -> list of values
+
+	def add(self, keyword: str, value):
+		"""Adds a value to a keyword."""
+		values = self.values.get(keyword)
+		if values is None:
+			self.values[keyword] = [value]
+			node = 0
+			for char in keyword:
+				nxt = self._goto[node].get(char)
+				if nxt is None:
+					nxt = len(self._goto)
+					self._goto[node][char] = nxt
+					self._goto.append({})
+					self._keyword.append(None)
+					self._fail.append(0)
+					self._outputs.append(())
+					self._built = False
+				node = nxt
+			if self._keyword[node] is None:
+				self._keyword[node] = keyword
+				self._built = False
+		else:
+			values.append(value)
+
+	def remove(self, keyword: str, value):
+		"""Removes a value from a keyword. The keyword is not matched anymore if it has no value left."""
+		values = self.values.get(keyword)
+		if values is not None:
+			values.remove(value)
+			if not values:
+				del self.values[keyword]  # its node stays in the trie, find() skips it
+
+	def _build(self):
+		# Computes the failure links in breadth-first order, so that the links of the shorter prefixes are ready
+		queue = list(self._goto[0].values())
+		for node in queue:
+			self._fail[node] = 0
+		for node in queue:  # the queue grows during the iteration
+			own = (node,) if self._keyword[node] is not None else ()
+			self._outputs[node] = own + self._outputs[self._fail[node]]
+			for char, child in self._goto[node].items():
+				fail = self._fail[node]
+				while fail and char not in self._goto[fail]:
+					fail = self._fail[fail]
+				self._fail[child] = self._goto[fail].get(char, 0)
+				queue.append(child)
+		self._built = True
+
+	def find(self, text: str):
+		"""
+		Finds the keywords that occur in the text, including the overlapping ones.
+		:return: the set of the keywords found
+		"""
+		if not self._built:
+			self._build()
+		goto, fail, outputs, keyword = self._goto, self._fail, self._outputs, self._keyword
+		found = set()
+		node = 0
+		for char in text:
+			while node and char not in goto[node]:
+				node = fail[node]
+			node = goto[node].get(char, 0)
+			for out in outputs[node]:
+				found.add(keyword[out])
+		values = self.values
+		return {k for k in found if k in values}
+
+
 def max_str_len(matrix):
 	max_length = 0
 	for row in matrix:
@@ -156,21 +238,3 @@ def pretty_matrix_str(matrix):
 			j += 1
 		res.append(" | ".join(line))
 	return "\n".join(res)
-
-
-def jsonize(s):
-	if s is None:
-		return "null"
-	if isinstance(s, int):
-		return str(s)
-	elif isinstance(s, float):
-		return str(s)
-	elif isinstance(s, bool):
-		return str(s).lower()
-	elif isinstance(s, str):
-		return f'"{str(s)}"'
-	elif isinstance(s, list):
-		content = ",".join([jsonize(e) for e in s])
-		return f'[{content}]'
-	else:
-		return s.json()
@@ -8,5 +8,6 @@ setup(
 	license='GPLv3',
 	author='TheElectronWill',
 	description='Data extractor for Tuubes',
-	install_requires=['beautifulsoup4', 'requests', 'requests-cache']
+	install_requires=['beautifulsoup4', 'lxml', 'requests'],
+	extras_require={'zstd': ['zstandard']}
 )
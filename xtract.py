@@ -1,18 +1,32 @@
 #!/usr/bin/python3
 
 import os
+import re
 import sys
 import shutil
-import requests_cache
 
-from getopt import getopt, GetoptError
+from getopt import gnu_getopt, GetoptError
 from datatractor.main.extractors import PacketsExtractor, BlocksExtractor
+from datatractor.main.prefetcher import prefetch
+from datatractor.main import packets_extractor as p_extractor
+from datatractor.utils import html_tools, http_tools
 
 # Main program
-usage = "xtract.py -v <game_version> [-o <output_dir>] [--nocache | --cachetime <cache_timeout>]"
+usage = "xtract.py [prefetch] -v <game_version> [<more_versions...>] [-o <output_dir>] [--nocache | --cachetime <cache_timeout> --cachesize <megabytes>] [--poolsize <n>] [-j <jobs>] [--record <archive> | --replay <archive>] [--hedge <percentile>] [--rate <requests_per_second>] [--maxinflight <n>] [--parser <bs4|lxml>] [--processes <n>] [--emit-json]"
+
+# The versions like 1.12.2, 1.13-pre3 or the snapshots like 17w45a
+version_pattern = re.compile("\\d+\\.\\d+[\\w.\\- ]*|\\d{2}w\\d{2}[a-z]")
+
+# The prefetch command fills the HTTP cache with all the pages needed by the extractors
+command = "extract"
+argv = sys.argv[1:]
+if len(argv) > 0 and argv[0] == "prefetch":
+	command = "prefetch"
+	argv = argv[1:]
 
 try:
-	opts, args = getopt(sys.argv[1:], "v:o:pb", ["packets, blocks, help, nocache, cachetime="])
+	# The options may follow the versions, like in "prefetch -v 1.12.2 1.13 -j 8"
+	opts, args = gnu_getopt(argv, "v:o:pbj:", ["packets", "blocks", "help", "nocache", "cachetime=", "cachesize=", "poolsize=", "jobs=", "record=", "replay=", "hedge=", "rate=", "maxinflight=", "parser=", "processes=", "emit-json"])
 except GetoptError:
 	print("Usage:", usage)
 	exit(2)
@@ -24,6 +38,15 @@ else:
 	output_dir = None
 	use_cache = True
 	cache_timeout = 300
+	cache_size = None
+	jobs = 1
+	processes = 1
+	emit_json = False
+	record_archive = None
+	replay_archive = None
+	hedge_percentile = None
+	rate_limit = 10.0
+	max_in_flight = 8
 	for opt, arg in opts:
 		if opt == "--help":
 			print("xtract.py - Data extractor for Tuubes (http://tuubes.org)")
@@ -37,36 +60,113 @@ else:
 			use_cache = False
 		elif opt == "--cachetime":
 			cache_timeout = int(arg)
+		elif opt == "--cachesize":
+			cache_size = int(arg) * 1024 * 1024
+		elif opt == "--poolsize":
+			http_tools.configure_session(maxsize=int(arg))
+		elif opt == "-j" or opt == "--jobs":
+			jobs = int(arg)
+		elif opt == "--record":
+			record_archive = arg
+		elif opt == "--replay":
+			replay_archive = arg
+		elif opt == "--hedge":
+			hedge_percentile = float(arg)
+		elif opt == "--rate":
+			rate_limit = float(arg)
+			if rate_limit < 0:
+				print("Invalid rate %s, expected a positive number of requests per second, or 0 for no limit" % arg)
+				exit(2)
+		elif opt == "--maxinflight":
+			max_in_flight = int(arg)
+		elif opt == "--parser":
+			if arg not in html_tools.backends:
+				print("Unknown parser %s, expected one of %s" % (arg, html_tools.backends))
+				exit(2)
+			html_tools.backend = arg
+		elif opt == "--processes":
+			processes = int(arg)
+		elif opt == "--emit-json":
+			emit_json = True
 
+	if record_archive and replay_archive:
+		print("--record and --replay can't be used together, since the replay must not access the network")
+		print("Usage:", usage)
+		exit(2)
 	if not game_version:
 		print("Missing parameter: -v <game_version>")
 		game_version = input("Please enter a version: ")
-	if not output_dir:
+	versions = [game_version] + args if command == "prefetch" else [game_version]
+	invalid = [v for v in versions if not version_pattern.fullmatch(v)]
+	if invalid:
+		print("Invalid game version(s): %s" % ", ".join(invalid))
+		print("Usage:", usage)
+		exit(2)
+	if command == "prefetch":
+		output_dir = None  # nothing is generated
+	elif not output_dir:
 		output_dir = "%s/out/generated_%s" % (os.getcwd(), game_version)
-	if output_dir.endswith("/"):
+	if output_dir and output_dir.endswith("/"):
 		output_dir = output_dir[:-1]
 
-	print("Using output dir %s" % output_dir)
-	if os.path.isdir(output_dir):
-		shutil.rmtree(output_dir, ignore_errors=True)
-		print("Output dir cleaned")
+	if output_dir:
+		print("Using output dir %s" % output_dir)
+		if os.path.isdir(output_dir):
+			shutil.rmtree(output_dir, ignore_errors=True)
+			print("Output dir cleaned")
 
-	if use_cache:
-		print("Using requests_cache with a timeout of %s seconds" % cache_timeout)
-		requests_cache.install_cache("out/http_cache", "sqlite", cache_timeout)
+	# The workers are forked before the HTTP session, the rate limiter and the hedger start any thread
+	if command != "prefetch" and processes > 1:
+		print("Analysing the packets in %d processes, when there are enough of them" % processes)
+		p_extractor.install_pool(processes)
 
-	for opt, arg in opts:
-		if opt == "-p" or opt == "--packets":
-			extractors.append(PacketsExtractor(game_version))
-		elif opt == "-b" or opt == "--blocks":
-			extractors.append(BlocksExtractor(game_version))
+	if jobs > http_tools.pool_maxsize:
+		http_tools.configure_session(maxsize=jobs)
+
+	if rate_limit:
+		print("Limiting the requests to %s per second and %d at once per host" % (rate_limit, max_in_flight))
+		http_tools.limit_hosts(rate_limit, max(1, int(rate_limit)), max_in_flight)
+	else:
+		print("Limiting the requests to %d at once per host" % max_in_flight)
+		http_tools.limit_hosts(None, 1, max_in_flight)
+	if hedge_percentile:
+		print("Hedging the requests slower than the %sth percentile" % hedge_percentile)
+		http_tools.enable_hedging(hedge_percentile / 100)
+
+	if replay_archive:
+		print("Replaying the HTTP responses of %s, without network access" % replay_archive)
+		http_tools.replay(replay_archive)
+	elif use_cache:
+		print("Using the HTTP cache with a timeout of %s seconds, except for fixed revisions" % cache_timeout)
+		http_tools.install_cache("out/http_cache", cache_timeout, cache_size)
+	# The recorded or replayed runs parse and analyse every page, so that the archive gets all of them and the timings
+	# are real
+	if use_cache and not record_archive and not replay_archive:
+		print("Using the cache of the parsed pages")
+		html_tools.install_tree_cache("out/tree_cache")
+		print("Using the cache of the analysed protocols")
+		p_extractor.install_ir_cache("out/ir_cache")
+	if record_archive:
+		print("Recording the HTTP responses in %s" % record_archive)
+		http_tools.record(record_archive)
+
+	if command == "prefetch":
+		prefetch(versions, jobs)
+	else:
+		for opt, arg in opts:
+			if opt == "-p" or opt == "--packets":
+				extractors.append(PacketsExtractor(game_version, emit_json))
+			elif opt == "-b" or opt == "--blocks":
+				extractors.append(BlocksExtractor(game_version, jobs))
 
-	if len(extractors) == 0:
-		print("No extractors specified => running the packet extractor.")
-		extractors = [PacketsExtractor(game_version)]
+		if len(extractors) == 0:
+			print("No extractors specified => running the packet extractor.")
+			extractors = [PacketsExtractor(game_version, emit_json)]
 
-	for extractor in extractors:
-		print("====", extractor.name, "====")
-		extractor.extract(output_dir)
-		print("============================\n")
+		for extractor in extractors:
+			print("====", extractor.name, "====")
+			extractor.extract(output_dir)
+			print("============================\n")
+	limiter = http_tools.limiter
+	print("Waited %.1f seconds on the rate limiter, for %d requests" % (limiter.wait_time, limiter.waits))
 	print("Done!")